@@ -0,0 +1,267 @@
+# Animated poster output (GIF or WebP) for jobs whose assets include animated GIFs/WebPs.
+#
+# The background, logo, still assets and text are composited once. The animated assets keep
+# the place the still layout gives their first frame, and every frame after the first only
+# re-blends the box they cover: the static layer under the box, the assets' frames, then
+# whatever text crosses the box. The first frame is written whole and each later frame is just
+# that box, placed at its offset, so encoding costs the size of the box, not the canvas. The
+# files are written chunk by chunk here (as poster_tiles does for PNG) with Pillow encoding
+# each frame or box as a still; no frame is kept once it is written.
+#
+# GIF frames share one global palette, built from a sample of the still frame and the
+# animated boxes. Nothing is dithered, so pixels that do not change keep their palette index
+# from frame to frame.
+#
+# The output has as many frames as the longest animation and takes its frame durations and
+# loop count; shorter animations start over.
+import io
+import math
+import os
+import struct
+import time
+
+from PIL import Image, ImageSequence
+
+import poster_generator as gen
+from poster_composite import composite, intersects
+from poster_output import EncodeResult, StreamedFile, encoder_settings
+from poster_trace import stage
+
+ANIMATED_FORMATS = ('GIF', 'WEBP')
+# GIF frames without a duration are shown for this many milliseconds
+DEFAULT_DURATION = 100
+# The palette sample holds the still frame at this size and at most this many animated boxes
+PALETTE_SAMPLE_SIZE = 768
+PALETTE_SAMPLE_FRAMES = 8
+
+_FRAME_COUNTS = {}
+
+
+def frame_count(path):
+    """Number of frames in an image file (1 for stills and unreadable files)."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 1
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    if key not in _FRAME_COUNTS:
+        try:
+            with Image.open(path) as im:
+                _FRAME_COUNTS[key] = getattr(im, 'n_frames', 1)
+        except (OSError, ValueError):
+            _FRAME_COUNTS[key] = 1
+    return _FRAME_COUNTS[key]
+
+
+def animated_assets(job):
+    """The asset files of a resolved job that have more than one frame."""
+    return [f for f in gen.list_asset_files(job['assets_dir']) if frame_count(f) > 1]
+
+
+def is_animated_job(job):
+    """True if a resolved job is written as an animation: GIF/WebP output with an animated asset."""
+    return job['format'] in ANIMATED_FORMATS and not job.get('strip_height') and bool(animated_assets(job))
+
+
+def timeline(path):
+    """Return (durations in ms, loop) of an animated file; loop is None to play once."""
+    with Image.open(path) as im:
+        loop = im.info.get('loop')
+        durations = [frame.info.get('duration') or DEFAULT_DURATION for frame in ImageSequence.Iterator(im)]
+    return durations, loop
+
+
+def asset_frames(path, box):
+    """Yield path's frames as RGBA images fitted into box, the same way its still thumbnail is
+    made, starting over after the last frame."""
+    while True:
+        with Image.open(path) as im:
+            for frame in ImageSequence.Iterator(im):
+                thumb = frame.convert('RGBA')
+                thumb.thumbnail(tuple(box), Image.LANCZOS)
+                yield thumb
+
+
+class Animation:
+    """The static layers of an animated job and the box its animated assets redraw."""
+
+    def __init__(self, job):
+        files = gen.list_asset_files(job['assets_dir'])
+        animated = [f for f in files if frame_count(f) > 1]
+        with stage('base_layer'):
+            self.under = gen.build_base_layer(job, files, skip=animated)
+        width, height = self.size = self.under.size
+        self.asset_box = gen.asset_box(self.size)
+        placements = [(path, im, pos) for path, im, pos in gen.asset_placements(self.size, files) if path in animated]
+        self.paths = [path for path, _, _ in placements]
+        self.positions = [pos for _, _, pos in placements]
+        runs = gen.layout_text_blocks(self.size, job['lines'], job['positions'], gen.load_fonts())
+        with stage('text'):
+            self.tiles = [gen.text_tile(run.pos, run.text, run.font, run.fill, run.bold_available) for run in runs]
+            self.still = self.under.copy()
+            composite(self.still, self.tiles)
+        # the box every animated asset fits in; WebP frame offsets must be even
+        x0 = min(x for _, _, (x, _) in placements)
+        y0 = min(y for _, _, (_, y) in placements)
+        x1 = max(x + im.width for _, im, (x, _) in placements)
+        y1 = max(y + im.height for _, im, (_, y) in placements)
+        self.box = (max(x0, 0) // 2 * 2, max(y0, 0) // 2 * 2, min(x1, width), min(y1, height))
+        self.frames = max(frame_count(p) for p in self.paths)
+        self.durations, self.loop = timeline(max(self.paths, key=frame_count))
+
+    def patches(self):
+        """Yield the box of every output frame as an RGB image."""
+        box = self.box
+        tiles = [(tile, (x - box[0], y - box[1])) for tile, (x, y) in self.tiles
+                 if intersects(box, (x, y, x + tile.width, y + tile.height))]
+        streams = [asset_frames(path, self.asset_box) for path in self.paths]
+        for _ in range(self.frames):
+            patch = self.under.crop(box)
+            composite(patch, [(next(s), (x - box[0], y - box[1])) for s, (x, y) in zip(streams, self.positions)]
+                      + tiles)
+            yield patch
+
+    def first_frame(self, patch):
+        frame = self.still.copy()
+        frame.paste(patch, self.box[:2])
+        return frame
+
+    def palette(self):
+        """A palette image for the still frame and a sample of the animated boxes."""
+        factor = max(1, math.ceil(max(self.size) / PALETTE_SAMPLE_SIZE))
+        step = math.ceil(self.frames / PALETTE_SAMPLE_FRAMES)
+        parts = [self.still.reduce(factor)]
+        parts += [patch.reduce(factor) for i, patch in enumerate(self.patches()) if i % step == 0]
+        sample = Image.new('RGB', (max(p.width for p in parts), sum(p.height for p in parts)))
+        y = 0
+        for part in parts:
+            sample.paste(part, (0, y))
+            y += part.height
+        return sample.quantize(256, method=Image.Quantize.MEDIANCUT)
+
+
+def _riff_chunks(data, offset):
+    # (fourcc, payload) of every chunk in a RIFF body starting at offset
+    while offset + 8 <= len(data):
+        fourcc, size = data[offset:offset + 4], struct.unpack('<I', data[offset + 4:offset + 8])[0]
+        yield fourcc, data[offset + 8:offset + 8 + size]
+        offset += 8 + size + (size & 1)
+
+
+def _riff_chunk(fourcc, payload):
+    return fourcc + struct.pack('<I', len(payload)) + payload + (b'\0' if len(payload) & 1 else b'')
+
+
+def _u24(value):
+    return struct.pack('<I', value)[:3]
+
+
+def webp_frame_data(image, settings):
+    """Encode image as a still WebP and return its image chunks (ALPH, VP8 or VP8L) for an ANMF frame."""
+    buf = io.BytesIO()
+    image.save(buf, 'WEBP', **settings)
+    return b''.join(_riff_chunk(fourcc, payload) for fourcc, payload in _riff_chunks(buf.getvalue(), 12)
+                    if fourcc in (b'ALPH', b'VP8 ', b'VP8L'))
+
+
+def write_webp_animation(path, size, frames, loop, settings):
+    """Write [(image, (x, y), duration_ms)] as an animated WebP at path, each frame drawn over
+    the previous one at (x, y) (which must be even). Returns (bytes, encode_s, write_s)."""
+    encode_seconds = 0.0
+    with StreamedFile(path) as out:
+        write = out.write
+        # the RIFF size is patched in once every frame is written
+        write(b'RIFF\0\0\0\0WEBP')
+        # VP8X: animation flag, then the canvas size; ANIM: background colour (BGRA) and loop count
+        write(_riff_chunk(b'VP8X', bytes((0x02, 0, 0, 0)) + _u24(size[0] - 1) + _u24(size[1] - 1)))
+        write(_riff_chunk(b'ANIM', bytes((255, 255, 255, 255)) + struct.pack('<H', 1 if loop is None else loop)))
+        for image, (x, y), duration in frames:
+            start = time.perf_counter()
+            with stage('encode_frame', format='WEBP'):
+                data = webp_frame_data(image, settings)
+            encode_seconds += time.perf_counter() - start
+            # ANMF: offset / 2, size - 1, duration, then "do not blend, do not dispose"
+            header = (_u24(x // 2) + _u24(y // 2) + _u24(image.width - 1) + _u24(image.height - 1)
+                      + _u24(duration) + bytes((0x02,)))
+            write(_riff_chunk(b'ANMF', header + data))
+        out.patch(4, struct.pack('<I', out.bytes - 8))
+    return out.bytes, encode_seconds, out.write_seconds
+
+
+def gif_frame_data(image):
+    """Encode a P image as a still GIF and return its image descriptor and LZW data."""
+    buf = io.BytesIO()
+    image.save(buf, 'GIF', optimize=False)
+    data = buf.getvalue()
+    flags = data[10]
+    pos = 13 + (3 << ((flags & 7) + 1) if flags & 0x80 else 0)
+    # skip any extension blocks Pillow wrote before the image
+    while data[pos] == 0x21:
+        pos += 2
+        while data[pos]:
+            pos += data[pos] + 1
+        pos += 1
+    # everything up to the trailer
+    return data[pos:-1]
+
+
+def write_gif_animation(path, size, frames, palette, loop):
+    """Write [(P image, (x, y), duration_ms)] on one palette as an animated GIF at path, each
+    frame drawn over the previous one at (x, y). Returns (bytes, encode_s, write_s)."""
+    encode_seconds = 0.0
+    colors = palette.getpalette()[:768]
+    colors += [0] * (768 - len(colors))
+    with StreamedFile(path) as out:
+        write = out.write
+        # logical screen with a 256-entry global colour table
+        write(b'GIF89a' + struct.pack('<HHBBB', size[0], size[1], 0xF7, 0, 0) + bytes(colors))
+        if loop is not None:
+            write(b'\x21\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', loop) + b'\x00')
+        for image, (x, y), duration in frames:
+            start = time.perf_counter()
+            with stage('encode_frame', format='GIF'):
+                data = bytearray(gif_frame_data(image))
+            encode_seconds += time.perf_counter() - start
+            data[1:5] = struct.pack('<HH', x, y)
+            # graphic control: keep this frame under the next one, delay in 1/100 s
+            write(b'\x21\xf9\x04\x04' + struct.pack('<H', round(duration / 10)) + b'\x00\x00' + bytes(data))
+        write(b'\x3b')
+    return out.bytes, encode_seconds, out.write_seconds
+
+
+def render_animated(job, on_first_frame=None):
+    """Render an animated job straight into its GIF/WebP output. Returns an EncodeResult.
+
+    on_first_frame(image) receives the first frame as an RGB image, e.g. for a proof proxy."""
+    fmt = job['format']
+    if fmt not in ANIMATED_FORMATS:
+        raise ValueError(f"animated output is GIF or WEBP, not {fmt}")
+    if job['derivatives']:
+        raise ValueError("derivatives are not made for animated output")
+    out_dir = os.path.dirname(job['output'])
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    animation = Animation(job)
+    durations = animation.durations
+    palette = animation.palette() if fmt == 'GIF' else None
+
+    def frames():
+        for i, patch in enumerate(animation.patches()):
+            duration = durations[i % len(durations)]
+            if i == 0:
+                image, pos = animation.first_frame(patch), (0, 0)
+                if on_first_frame:
+                    on_first_frame(image)
+            else:
+                image, pos = patch, animation.box[:2]
+            if palette is not None:
+                image = image.quantize(palette=palette, dither=Image.Dither.NONE)
+            yield image, pos, duration
+
+    if fmt == 'GIF':
+        written, encode_s, write_s = write_gif_animation(job['output'], animation.size, frames(), palette,
+                                                         animation.loop)
+    else:
+        written, encode_s, write_s = write_webp_animation(job['output'], animation.size, frames(), animation.loop,
+                                                          encoder_settings('WEBP', job['encoder']))
+    return EncodeResult(job['output'], fmt, written, encode_s, write_s)
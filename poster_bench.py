@@ -0,0 +1,309 @@
+# Benchmarks for the render pipeline at realistic poster sizes.
+#
+# Synthetic backgrounds, logos and assets are generated for each size, then every stage of
+# poster_generator's pipeline is timed on its own (cold, with the caches that would hide the
+# work emptied) along with a warm end-to-end render and batch throughput per worker count.
+# Stages are timed in rounds, one run of each per round, so drift in machine speed during the
+# run lands in every stage's spread instead of shifting a single stage.
+#
+#   python poster_bench.py -o bench.json
+#   python poster_bench.py --compare bench.json --threshold 0.15
+#
+# A stage is flagged as a regression only when its median is slower than the baseline's by
+# more than the threshold plus the run-to-run noise both runs measured (NOISE_MADS median
+# absolute deviations), and even its fastest run is slower than the baseline median.
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import PIL
+from PIL import Image, ImageDraw
+
+import poster_generator as gen
+from poster_cache import LogoCache, ThumbnailCache
+from poster_layout import wrap_text
+from poster_output import save_image
+
+# name -> canvas size; 'print' is A3 at 300 dpi
+SIZES = {
+    'social': (1080, 1080),
+    'standard': (3375, 3375),
+    'print': (3508, 4961),
+}
+
+# Layout of the shipped 3375px template, as fractions of the canvas
+REFERENCE_SIZE = 3375
+REFERENCE_POSITIONS = {'1': (1657, 450), '2': (1657, 701), '3': (300, 2879), 'logo': (2678, 2950)}
+REFERENCE_LOGO_BOX = 900
+
+LINES = [
+    "1. World Mental Health Day",
+    "2. Celebrating Courage, Inclusion, and Well-being",
+    "3. Reskilled. Resilient. Ready to Contribute. Empower Neurodiverse Talent. Hire with Heart. "
+    "Every poster in a batch carries a paragraph of about this length, so wrapping is exercised.",
+]
+
+# Median absolute deviations of noise allowed on top of --threshold
+NOISE_MADS = 3
+
+STAGES = ('decode', 'logo_paste', 'draw_bold_text', 'body_wrap', 'place_assets', 'base_copy', 'save', 'render')
+
+
+def make_fixtures(root, name, size):
+    """Write a background, logo and asset set for a canvas of size under root/name. Returns a job spec."""
+    out = os.path.join(root, name)
+    assets = os.path.join(out, 'assets')
+    os.makedirs(assets, exist_ok=True)
+    w, h = size
+
+    # Gradient plus noise, so PNG decode does realistic work instead of inflating flat runs
+    gradient = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, 24)
+    bg = Image.merge('RGB', (gradient, noise, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+    background = os.path.join(out, 'background.png')
+    bg.save(background)
+
+    # Wide logo with a transparent surround, like the real one
+    logo = Image.new('RGBA', (max(8, w // 2), max(2, w * 23 // 200)), (0, 0, 0, 0))
+    ImageDraw.Draw(logo).rounded_rectangle((0, 0, logo.width - 1, logo.height - 1),
+                                           radius=logo.height // 4, fill=(20, 60, 160, 255))
+    logo_file = os.path.join(out, 'logo.png')
+    logo.save(logo_file)
+
+    asset_size = (w // 2, h // 2)
+    for i in range(3):
+        im = Image.effect_noise(asset_size, 40 + 20 * i).convert('RGB')
+        im.save(os.path.join(assets, f'asset{i}.jpeg'), quality=90)
+    cutout = Image.new('RGBA', asset_size, (0, 0, 0, 0))
+    ImageDraw.Draw(cutout).ellipse((0, 0, asset_size[0] - 1, asset_size[1] - 1), fill=(200, 80, 40, 255))
+    cutout.save(os.path.join(assets, 'asset3.png'))
+
+    scale = w / REFERENCE_SIZE
+    positions = {k: [int(x * scale), int(y * h / REFERENCE_SIZE)] for k, (x, y) in REFERENCE_POSITIONS.items()}
+    box = max(1, int(REFERENCE_LOGO_BOX * scale))
+    return {
+        'background': background,
+        'logo': logo_file,
+        'assets_dir': assets,
+        'positions': positions,
+        'logo_size': [box, box],
+        'lines': LINES,
+        'output': os.path.join(out, 'poster.jpg'),
+    }
+
+
+def _summary(samples):
+    ms = [s * 1000 for s in samples]
+    median = statistics.median(ms)
+    return {'min_ms': round(min(ms), 3), 'median_ms': round(median, 3),
+            'mean_ms': round(statistics.fmean(ms), 3),
+            'mad_ms': round(statistics.median(abs(m - median) for m in ms), 3), 'runs': len(ms)}
+
+
+def time_stages(stages, repeat):
+    """Time [(name, fn, setup, context)] in repeat rounds, one run of every stage per round:
+    inside context(), setup() runs and then only fn(state) is timed. Interleaving the stages
+    spreads slow drift in machine speed over the samples of every stage, where their spread
+    shows it. Returns name -> timing summary."""
+    samples = {name: [] for name, _, _, _ in stages}
+    for _ in range(repeat):
+        for name, fn, setup, context in stages:
+            with context():
+                state = setup()
+                start = time.perf_counter()
+                fn(state)
+                samples[name].append(time.perf_counter() - start)
+    return {name: _summary(times) for name, times in samples.items()}
+
+
+@contextlib.contextmanager
+def cold_caches(scratch):
+    """Swap in empty logo and thumbnail caches (the thumbnails in a fresh directory)."""
+    saved = gen.LOGOS, gen.THUMBNAILS
+    thumbs = tempfile.mkdtemp(prefix='thumbs-', dir=scratch)
+    gen.LOGOS, gen.THUMBNAILS = LogoCache(), ThumbnailCache(cache_dir=thumbs)
+    gen.TEXT_RUNS.clear()
+    try:
+        yield
+    finally:
+        gen.LOGOS, gen.THUMBNAILS = saved
+        shutil.rmtree(thumbs, ignore_errors=True)
+
+
+def bench_stages(spec, repeat, scratch):
+    """Time each pipeline stage for one fixture. Returns stage -> timing summary."""
+    job = gen.resolve_spec(spec)
+    fonts = gen.load_fonts()
+    decoded = gen.load_background(job['background'])
+    asset_files = gen.list_asset_files(job['assets_dir'])
+    title_font, title_bold = fonts['title']
+    body_font, _ = fonts['body']
+    title_pos = tuple(job['positions']['1'])
+    body_width = decoded.width - job['positions']['3'][0] - 50
+    out = os.path.join(scratch, 'bench_save.jpg')
+
+    def cold():
+        # the caches are swapped before the timer starts and restored after it stops
+        return cold_caches(scratch)
+
+    warm = contextlib.nullcontext
+    nothing = lambda: None
+    return time_stages([
+        ('decode', lambda _: gen.load_background(job['background']), nothing, warm),
+        ('logo_paste', lambda im: gen.paste_logo(im, job['logo'], job['positions'], job['logo_size']),
+         decoded.copy, cold),
+        ('draw_bold_text', lambda im: gen.draw_bold_text(im, title_pos, job['lines'][0], title_font, (0, 0, 0),
+                                                         title_bold), decoded.copy, cold),
+        ('body_wrap', lambda _: wrap_text(job['lines'][2], body_font, body_width, gen.TEXT_RUNS), nothing, cold),
+        ('place_assets', lambda im: gen.place_assets(im, asset_files), decoded.copy, cold),
+        # the per-poster copy of the cached base layer
+        ('base_copy', lambda _: decoded.copy(), nothing, warm),
+        ('save', lambda _: save_image(decoded, out, job['format'], job['encoder']), nothing, warm),
+        # End to end with warm caches, as every poster after the first in a batch renders; the
+        # untimed render first re-warms what the cold stages emptied
+        ('render', lambda _: gen.render_job(job), lambda: gen.render_job(job), warm),
+    ], repeat)
+
+
+def bench_batch(spec, jobs, worker_counts, scratch):
+    """Render jobs variants of spec with each worker count. Returns workers -> throughput.
+
+    Each job appends its number to the body text: identical jobs would be rendered once and
+    copied (see poster_scheduler), which is not the throughput being measured."""
+    jobs_file = os.path.join(scratch, 'bench_jobs.jsonl')
+    job = {k: v for k, v in spec.items() if k != 'output'}
+    lines = job['lines']
+    with open(jobs_file, 'w', encoding='utf-8') as f:
+        for i in range(jobs):
+            variant = lines[:2] + [f"{lines[2]} #{i + 1}"] + lines[3:]
+            f.write(json.dumps(dict(job, lines=variant)) + '\n')
+    results = {}
+    for workers in worker_counts:
+        out_dir = tempfile.mkdtemp(prefix=f'batch{workers}-', dir=scratch)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            rendered, failed = gen.run_batch(jobs_file, workers=workers, output_dir=out_dir)
+        seconds = time.perf_counter() - start
+        shutil.rmtree(out_dir, ignore_errors=True)
+        results[str(workers)] = {'seconds': round(seconds, 3), 'posters_per_s': round(rendered / seconds, 3),
+                                 'rendered': rendered, 'failed': failed}
+    return results
+
+
+def run_benchmarks(sizes, repeat=9, batch_jobs=16, worker_counts=(1, 2, 4), fixtures_dir=None):
+    """Run the suite and return the results as a JSON-serialisable dict."""
+    scratch = fixtures_dir or tempfile.mkdtemp(prefix='poster-bench-')
+    try:
+        report = {
+            'meta': {
+                'python': platform.python_version(),
+                'pillow': PIL.__version__,
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'repeat': repeat,
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            },
+            'stages': {},
+            'batch': {},
+        }
+        for name in sizes:
+            size = SIZES[name]
+            print(f"⏱️ {name} ({size[0]}x{size[1]})", file=sys.stderr)
+            spec = make_fixtures(scratch, name, size)
+            report['stages'][name] = bench_stages(spec, repeat, scratch)
+            if batch_jobs and worker_counts:
+                report['batch'][name] = bench_batch(spec, batch_jobs, worker_counts, scratch)
+        return report
+    finally:
+        if fixtures_dir is None:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+def noise(timing):
+    """Run-to-run noise of a stage timing, relative to its median (0 for older results)."""
+    return NOISE_MADS * timing.get('mad_ms', 0) / timing['median_ms'] if timing['median_ms'] > 0 else 0
+
+
+def compare(report, baseline, threshold=0.10):
+    """Return a list of regressions relative to baseline: stages whose median is slower by
+    more than threshold plus the noise of both runs and whose fastest run is still slower than
+    the baseline median, and worker counts whose throughput dropped by more than threshold."""
+    regressions = []
+    for size, stages in report.get('stages', {}).items():
+        for stage, timing in stages.items():
+            base = baseline.get('stages', {}).get(size, {}).get(stage)
+            if base and base['median_ms'] > 0:
+                ratio = timing['median_ms'] / base['median_ms']
+                allowed = threshold + max(noise(base), noise(timing))
+                if ratio > 1 + allowed and timing['min_ms'] > base['median_ms']:
+                    regressions.append((size, stage, base['median_ms'], timing['median_ms'], ratio))
+    for size, counts in report.get('batch', {}).items():
+        for workers, run in counts.items():
+            base = baseline.get('batch', {}).get(size, {}).get(workers)
+            if base and run['posters_per_s'] > 0:
+                ratio = base['posters_per_s'] / run['posters_per_s']
+                if ratio > 1 + threshold:
+                    regressions.append((size, f"batch x{workers} (posters/s)", base['posters_per_s'],
+                                        run['posters_per_s'], ratio))
+    return regressions
+
+
+def print_report(report):
+    for size, stages in report['stages'].items():
+        print(f"\n{size}")
+        for stage in STAGES:
+            t = stages.get(stage)
+            if t:
+                print(f"  {stage:<16}{t['median_ms']:>10.2f} ms  (min {t['min_ms']:.2f})")
+        for workers, run in report['batch'].get(size, {}).items():
+            print(f"  batch x{workers:<9}{run['posters_per_s']:>10.2f} posters/s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the poster render pipeline")
+    parser.add_argument('-o', '--output', default=None, help="write results as JSON to this file")
+    parser.add_argument('--sizes', default=','.join(SIZES), help=f"comma separated, from {', '.join(SIZES)}")
+    parser.add_argument('--repeat', type=int, default=9, help="timed runs per stage")
+    parser.add_argument('--batch-jobs', type=int, default=16, help="posters per batch run (0 to skip)")
+    parser.add_argument('--workers', default='1,2,4', help="comma separated worker counts for batch runs")
+    parser.add_argument('--fixtures-dir', default=None, help="keep generated fixtures here instead of a temp dir")
+    parser.add_argument('--compare', default=None, metavar='BASELINE', help="flag regressions against a saved result")
+    parser.add_argument('--threshold', type=float, default=0.10, help="allowed slowdown, on top of the measured noise, before flagging (0.10 = 10%%)")
+    args = parser.parse_args(argv)
+
+    sizes = [s.strip() for s in args.sizes.split(',') if s.strip()]
+    unknown = [s for s in sizes if s not in SIZES]
+    if unknown:
+        parser.error(f"unknown size(s): {', '.join(unknown)}")
+    worker_counts = [int(w) for w in args.workers.split(',') if w.strip()]
+
+    report = run_benchmarks(sizes, args.repeat, args.batch_jobs, worker_counts, args.fixtures_dir)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✅ Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) over {args.threshold:.0%}:")
+            for size, stage, before, after, ratio in regressions:
+                print(f"  {size} {stage}: {before:.2f} -> {after:.2f} ({ratio:.2f}x)")
+            return 1
+        print(f"\n✅ No regressions over {args.threshold:.0%} against {args.compare}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
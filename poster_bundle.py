@@ -0,0 +1,190 @@
+# Compile a poster template (positions.json + background + logo + fonts) into a single bundle file.
+#
+# The bundle stores decoded pixel buffers, so renderers memory-map it and build images with
+# Image.frombuffer instead of inflating the PNGs. The pages are read-only and shared by every
+# worker process that maps the same file.
+#
+# Layout: MAGIC, a little-endian uint64 header length, a JSON header, then each pixel buffer
+# aligned to PAGE_SIZE.
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+from PIL import Image
+
+from poster_cache import file_digest
+from poster_fonts import FONTS, FontResolution
+
+MAGIC = b'PSTRBND1'
+VERSION = 1
+PAGE_SIZE = 4096
+# Rows of the background converted and written at a time while compiling
+COMPILE_ROWS = 256
+
+
+def _align(n):
+    return (n + PAGE_SIZE - 1) // PAGE_SIZE * PAGE_SIZE
+
+
+def prepare_logo_image(logo_file, box_size):
+    """Return the logo resized to fit box_size, preserving aspect ratio."""
+    logo_img = Image.open(logo_file).convert('RGBA')
+    logo_img.thumbnail(tuple(box_size), Image.LANCZOS)
+    return logo_img
+
+
+def compile_template(positions_path=None, out_path='template.bundle', background=None, logo=None):
+    """Write a bundle for positions_path and return out_path.
+
+    background defaults to the 'background' recorded in positions.json, then the generator default."""
+    import poster_generator as gen
+
+    positions_path = positions_path or gen.positions_file
+    positions, logo_box = gen.load_positions(positions_path)
+    if background is None:
+        try:
+            with open(positions_path, 'r', encoding='utf-8') as pf:
+                background = json.load(pf).get('background')
+        except Exception:
+            background = None
+        background = background or gen.background_path
+    logo = logo or gen.logo_path
+
+    # Opaque backgrounds are stored as RGBA too, since frombuffer can only map RGBA/RGBX/L buffers.
+    # They are converted a few rows at a time as they are written, so only the decoded image is
+    # held whole.
+    bg = Image.open(background)
+    bg.load()
+    logo_img = prepare_logo_image(logo, logo_box) if os.path.exists(logo) else None
+
+    fonts = [FONTS.resolve(name, bold) for name, _, bold in gen.FONT_SPECS.values()]
+
+    key = hashlib.sha1()
+    for part in (file_digest(background), file_digest(logo), repr(tuple(logo_box))):
+        key.update(part.encode('utf-8') + b'\0')
+
+    buffers = [('background', background, bg)]
+    if logo_img is not None:
+        buffers.append(('logo', logo, logo_img))
+
+    header = {
+        'version': VERSION,
+        'key': key.hexdigest(),
+        'positions': positions,
+        'logo_size': list(logo_box),
+        'fonts': [list(res) for res in fonts],
+        'background': None,
+        'logo': None,
+    }
+    # Offsets depend on the header length, so lay out with a generous header reservation
+    header_room = _align(len(MAGIC) + 8 + len(json.dumps(header)) + 1024 * len(buffers) + 4096)
+    offset = header_room
+    for name, source, im in buffers:
+        length = im.width * im.height * 4
+        header[name] = {'source': source, 'mode': 'RGBA', 'size': list(im.size),
+                        'offset': offset, 'length': length}
+        offset = _align(offset + length)
+
+    raw_header = json.dumps(header).encode('utf-8')
+    if len(MAGIC) + 8 + len(raw_header) > header_room:
+        raise ValueError("bundle header does not fit in the reserved space")
+
+    # per-process temp name: several workers may compile the same bundle at once, and the last
+    # replace simply wins (the contents are identical)
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', len(raw_header)))
+            f.write(raw_header)
+            for name, _, im in buffers:
+                f.seek(header[name]['offset'])
+                for y in range(0, im.height, COMPILE_ROWS):
+                    rows = im.crop((0, y, im.width, min(im.height, y + COMPILE_ROWS)))
+                    f.write(rows.convert('RGBA').tobytes() if rows.mode != 'RGBA' else rows.tobytes())
+            f.truncate(offset)
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return out_path
+
+
+class TemplateBundle:
+    """A memory-mapped template bundle. background and logo are read-only images backed by the map."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a poster template bundle")
+        (header_len,) = struct.unpack_from('<Q', self._map, len(MAGIC))
+        start = len(MAGIC) + 8
+        header = json.loads(bytes(self._map[start:start + header_len]).decode('utf-8'))
+        if header.get('version') != VERSION:
+            raise ValueError(f"{path}: unsupported bundle version {header.get('version')}")
+        self.key = header['key']
+        self.positions = header['positions']
+        self.logo_size = tuple(header['logo_size'])
+        self.fonts = [FontResolution(*res) for res in header['fonts']]
+        self._entries = {'background': header['background'], 'logo': header['logo']}
+        self.background_source = header['background']['source']
+        self.background = self._image(header['background'])
+        self.logo_source = header['logo']['source'] if header['logo'] else None
+        self.logo = self._image(header['logo']) if header['logo'] else None
+
+    def _image(self, entry):
+        view = memoryview(self._map)[entry['offset']:entry['offset'] + entry['length']]
+        mode = entry['mode']
+        return Image.frombuffer(mode, tuple(entry['size']), view, 'raw', mode, 0, 1)
+
+    def release_rows(self, name, start_row, end_row):
+        """Tell the OS the mapped pages of rows [start_row, end_row) of an image are not needed now.
+
+        They stay valid and are read back from the file if touched again; this only keeps a
+        top-to-bottom pass over a huge image from accumulating resident pages."""
+        entry = self._entries.get(name)
+        if not entry or not hasattr(mmap, 'MADV_DONTNEED'):
+            return
+        row_bytes = entry['length'] // entry['size'][1]
+        start = _align(entry['offset'] + start_row * row_bytes)
+        end = (entry['offset'] + end_row * row_bytes) // PAGE_SIZE * PAGE_SIZE
+        if end > start:
+            self._map.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+
+# path -> ((mtime_ns, size), bundle); one mapping per process
+_BUNDLES = {}
+
+
+def load_bundle(path):
+    """Return the TemplateBundle for path, mapping it on first use and seeding the font registry."""
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _BUNDLES.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    bundle = TemplateBundle(path)
+    FONTS.seed(bundle.fonts)
+    _BUNDLES[path] = (stamp, bundle)
+    return bundle
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile positions.json and its images into a template bundle")
+    parser.add_argument('positions', nargs='?', default=None, help="positions.json to compile (default: the generator's)")
+    parser.add_argument('-o', '--output', default='template.bundle', help="bundle file to write")
+    parser.add_argument('--background', default=None, help="background image (default: from positions.json)")
+    parser.add_argument('--logo', default=None, help="logo image (default: the generator's logo.png)")
+    args = parser.parse_args(argv)
+    out = compile_template(args.positions, args.output, background=args.background, logo=args.logo)
+    print(f"✅ Template compiled to {out} ({os.path.getsize(out) / (1024 * 1024):.1f} MB)")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,487 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageDraw
+
+from poster_trace import stage
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+THUMBNAIL_DIR = os.path.join(SCRIPT_DIR, '.poster_cache', 'thumbs')
+# The thumbnail directory is trimmed to this size, least recently used first
+DEFAULT_THUMBNAIL_BYTES = 256 * 1024 * 1024
+
+# Each 3375x3375 RGBA layer is ~45 MB, so the default keeps about five of them
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# A 160 px title line on a 3375 px poster rasterizes to a tile of ~2 MB
+DEFAULT_TEXT_RUN_BYTES = 32 * 1024 * 1024
+
+# path -> ((mtime_ns, size), digest) so unchanged files are hashed only once
+_DIGESTS = {}
+
+
+def file_digest(path):
+    """Return a sha1 hex digest of the file contents, or '' if the file does not exist.
+
+    Digests are memoized on (mtime, size) so repeated calls for an unchanged file are a stat() only."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return ''
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _DIGESTS.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+    _DIGESTS[path] = (stamp, digest)
+    return digest
+
+
+def image_nbytes(im):
+    """Approximate in-memory size of a decoded PIL image."""
+    return im.width * im.height * len(im.getbands())
+
+
+def base_layer_key(background, logo, asset_files, logo_size, logo_pos, source_key=None):
+    """Build a cache key from the content of every static input of the base layer.
+
+    source_key replaces the background and logo digests when they are already known (e.g. a template bundle)."""
+    h = hashlib.sha1()
+    parts = (source_key,) if source_key else (file_digest(background), file_digest(logo))
+    for part in parts:
+        h.update(part.encode('ascii') + b'\0')
+    for f in asset_files:
+        h.update(file_digest(f).encode('ascii') + b'\0')
+    h.update(repr((tuple(logo_size), logo_pos)).encode('utf-8'))
+    return h.hexdigest()
+
+
+class BaseLayerCache:
+    """LRU of pre-composited static layers (background + logo + assets), bounded by total bytes.
+
+    Layers larger than max_bytes are built but never stored."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._layers = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._layers)
+
+    def get(self, key):
+        im = self._layers.get(key)
+        if im is None:
+            self.misses += 1
+            return None
+        self._layers.move_to_end(key)
+        self.hits += 1
+        return im
+
+    def put(self, key, im):
+        size = image_nbytes(im)
+        if key in self._layers:
+            self.current_bytes -= image_nbytes(self._layers.pop(key))
+        if size > self.max_bytes:
+            return
+        self._layers[key] = im
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            _, old = self._layers.popitem(last=False)
+            self.current_bytes -= image_nbytes(old)
+            self.evictions += 1
+
+    def get_or_build(self, key, build):
+        """Return the cached layer for key, calling build() and storing the result on a miss.
+
+        The returned image is shared; callers must copy() it before drawing on it."""
+        im = self.get(key)
+        if im is None:
+            im = build()
+            self.put(key, im)
+        return im
+
+    def clear(self):
+        self._layers.clear()
+        self.current_bytes = 0
+
+    def stats(self):
+        return {
+            'layers': len(self._layers),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+def font_key(font):
+    """Identify a loaded font face by (file, size); faces without a file path fall back to id()."""
+    path = getattr(font, 'path', None)
+    if not isinstance(path, str):
+        path = id(font)
+    return path, getattr(font, 'size', None)
+
+
+class TextRunCache:
+    """LRU of rasterized text runs and text measurements.
+
+    A run is stored as an RGBA tile (fill colour with the glyph coverage as alpha) keyed by
+    (font, size, text, stroke width, fill, sub-pixel offset), so drawing a repeated title or
+    footer is a single masked paste. Runs are bounded by the total bytes of their tiles, like
+    BaseLayerCache; tiles larger than max_bytes are returned but never stored."""
+
+    def __init__(self, max_bytes=DEFAULT_TEXT_RUN_BYTES, max_measures=4096):
+        self.max_bytes = max_bytes
+        self.max_measures = max_measures
+        self._runs = OrderedDict()
+        self.current_bytes = 0
+        self._measures = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.measure_hits = 0
+        self.measure_misses = 0
+
+    def bbox(self, font, text):
+        """Return text's (left, top, right, bottom) relative to the draw origin, like font.getbbox."""
+        key = (font_key(font), text)
+        box = self._measures.get(key)
+        if box is not None:
+            self._measures.move_to_end(key)
+            self.measure_hits += 1
+            return box
+        self.measure_misses += 1
+        box = tuple(font.getbbox(text))
+        self._measures[key] = box
+        if len(self._measures) > self.max_measures:
+            self._measures.popitem(last=False)
+        return box
+
+    def measure(self, font, text):
+        """Return (width, height) of text's bounding box, like ImageDraw.textbbox."""
+        left, top, right, bottom = self.bbox(font, text)
+        return right - left, bottom - top
+
+    def length(self, font, text):
+        """Return the advance width of text (font.getlength), memoized."""
+        key = (font_key(font), text, 'length')
+        value = self._measures.get(key)
+        if value is not None:
+            self._measures.move_to_end(key)
+            self.measure_hits += 1
+            return value
+        self.measure_misses += 1
+        value = font.getlength(text)
+        self._measures[key] = value
+        if len(self._measures) > self.max_measures:
+            self._measures.popitem(last=False)
+        return value
+
+    def run(self, font, text, fill, stroke=0, offsets=None, frac=(0.0, 0.0)):
+        """Return (tile, (dx, dy)): the rendered run and its offset from the integer draw origin."""
+        key = (font_key(font), text, stroke, tuple(fill), tuple(offsets or ()), frac)
+        entry = self._runs.get(key)
+        if entry is not None:
+            self._runs.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        entry = _rasterize_run(font, text, fill, stroke, offsets, frac)
+        size = image_nbytes(entry[0])
+        if size > self.max_bytes:
+            return entry
+        self._runs[key] = entry
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            _, (old, _) = self._runs.popitem(last=False)
+            self.current_bytes -= image_nbytes(old)
+        return entry
+
+    def clear(self):
+        self._runs.clear()
+        self._measures.clear()
+        self.current_bytes = 0
+
+    def stats(self):
+        return {
+            'runs': len(self._runs),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'measures': len(self._measures),
+            'measure_hits': self.measure_hits,
+            'measure_misses': self.measure_misses,
+        }
+
+
+def _rasterize_run(font, text, fill, stroke, offsets, frac):
+    offsets = offsets or [(0, 0)]
+    pad = max(max(abs(dx), abs(dy)) for dx, dy in offsets)
+    left, top, right, bottom = font.getbbox(text, stroke_width=stroke)
+    # one extra pixel for the sub-pixel start
+    w = right - left + 2 * pad + 1
+    h = bottom - top + 2 * pad + 1
+    mask = Image.new('L', (max(w, 1), max(h, 1)), 0)
+    mdraw = ImageDraw.Draw(mask)
+    for dx, dy in offsets:
+        origin = (frac[0] + dx - left + pad, frac[1] + dy - top + pad)
+        if stroke:
+            mdraw.text(origin, text, font=font, fill=255, stroke_width=stroke, stroke_fill=255)
+        else:
+            mdraw.text(origin, text, font=font, fill=255)
+    tile = Image.new('RGBA', mask.size, tuple(fill[:3]) + (255,))
+    tile.putalpha(mask)
+    return tile, (left - pad, top - pad)
+
+
+def trim_dir(directory, suffix, max_bytes, keep=()):
+    """Delete the least recently modified files ending in suffix from directory once they total
+    more than max_bytes, down to 3/4 of it so the next few writes do not trim again.
+
+    Files in keep and files that cannot be deleted (e.g. open on Windows) are left alone.
+    Returns (bytes left, files deleted)."""
+    entries = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name.endswith(suffix):
+                    st = entry.stat()
+                    entries.append((st.st_mtime_ns, st.st_size, entry.path))
+    except OSError:
+        return 0, 0
+    total = sum(size for _, size, _ in entries)
+    evicted = 0
+    if total > max_bytes:
+        keep = {os.path.abspath(p) for p in keep}
+        for _, size, path in sorted(entries):
+            if total <= max_bytes * 3 // 4:
+                break
+            if os.path.abspath(path) in keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+    return total, evicted
+
+
+class ThumbnailCache:
+    """Disk-backed cache of asset thumbnails keyed by (path, mtime, size, target box).
+
+    Misses are decoded on a thread pool. JPEGs use draft mode so the decoder reduces them
+    by a power of two while decoding instead of producing the full-resolution image.
+
+    Every box size gets its own files (each placer resize asks for a new one), so once the
+    directory grows past max_bytes the least recently used thumbnails are deleted. Hits
+    refresh a file's mtime, which is what recency is judged by."""
+
+    def __init__(self, cache_dir=THUMBNAIL_DIR, workers=4, max_bytes=DEFAULT_THUMBNAIL_BYTES):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.max_bytes = max_bytes
+        # bytes in cache_dir at the last scan plus what was written since; None until scanned
+        self.disk_bytes = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _cache_path(self, path, box):
+        st = os.stat(path)
+        key = repr((os.path.abspath(path), st.st_mtime_ns, st.st_size, tuple(box)))
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.png')
+
+    def _load_cached(self, cache_path):
+        try:
+            with Image.open(cache_path) as im:
+                thumb = im.convert('RGBA')
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(cache_path)
+        except OSError:
+            pass
+        return thumb
+
+    def _wrote(self, nbytes):
+        with self._lock:
+            if self.disk_bytes is not None:
+                self.disk_bytes += nbytes
+            if self.disk_bytes is None or self.disk_bytes > self.max_bytes:
+                self._trim()
+
+    def _trim(self):
+        total, evicted = trim_dir(self.cache_dir, '.png', self.max_bytes)
+        self.evictions += evicted
+        self.disk_bytes = total
+
+    def _build(self, path, box, cache_path):
+        with stage('thumbnail_decode', path=os.path.basename(path)), Image.open(path) as im:
+            if im.format == 'JPEG':
+                # reduce-on-decode to the smallest scale that still covers box
+                im.draft('RGB', tuple(box))
+            thumb = im.convert('RGBA')
+        with stage('thumbnail_resample'):
+            thumb.thumbnail(tuple(box), Image.LANCZOS)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            thumb.save(tmp_path, 'PNG')
+            os.replace(tmp_path, cache_path)
+            self._wrote(os.path.getsize(cache_path))
+        except OSError:
+            # a read-only cache dir only costs us the reuse
+            pass
+        return thumb
+
+    def load(self, path, box):
+        """Return path as an RGBA image fitted into box, or None if it cannot be decoded."""
+        return self.load_many([path], box)[0]
+
+    def load_many(self, paths, box):
+        """Return thumbnails for paths (None for undecodable files), preserving order."""
+        results = [None] * len(paths)
+        misses = []
+        for i, path in enumerate(paths):
+            try:
+                cache_path = self._cache_path(path, box)
+            except OSError:
+                continue
+            thumb = self._load_cached(cache_path) if os.path.exists(cache_path) else None
+            if thumb is not None:
+                self.hits += 1
+                results[i] = thumb
+            else:
+                self.misses += 1
+                misses.append((i, path, cache_path))
+
+        def build(item):
+            i, path, cache_path = item
+            try:
+                return i, self._build(path, box, cache_path)
+            except Exception:
+                return i, None
+
+        if len(misses) == 1:
+            done = [build(misses[0])]
+        elif misses:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(misses))) as pool:
+                done = list(pool.map(build, misses))
+        else:
+            done = []
+        for i, thumb in done:
+            results[i] = thumb
+        return results
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class LogoCache:
+    """In-memory cache of logos prepared for a (logo file, box size) pair.
+
+    A prepared logo is the resized logo as it would appear inside its transparent box, cropped
+    to the logo itself, plus its offset inside the box. Pasting it only composites the logo's
+    own bounding box, and reusing a logo at the same size costs no resampling."""
+
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self._logos = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, logo, box_size):
+        if isinstance(logo, Image.Image):
+            return ('image', id(logo), tuple(box_size))
+        st = os.stat(logo)
+        return (os.path.abspath(logo), st.st_mtime_ns, st.st_size, tuple(box_size))
+
+    def get(self, logo, box_size):
+        """Return (prepared_logo, (offset_x, offset_y)) for a logo path or RGBA image."""
+        key = self._key(logo, box_size)
+        entry = self._logos.get(key)
+        if entry is not None:
+            self._logos.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        with stage('logo_resample'):
+            entry = _prepare_logo(logo, box_size)
+        if isinstance(logo, Image.Image):
+            # keep the source alive so its id() is not reused by another image
+            entry = entry + (logo,)
+        self._logos[key] = entry
+        if len(self._logos) > self.max_entries:
+            self._logos.popitem(last=False)
+        return entry
+
+    def stats(self):
+        return {'logos': len(self._logos), 'hits': self.hits, 'misses': self.misses}
+
+
+def _prepare_logo(logo, box_size):
+    if isinstance(logo, Image.Image):
+        logo_img = logo.copy()
+    else:
+        logo_img = Image.open(logo).convert('RGBA')
+    max_w, max_h = box_size
+    # Preserve aspect ratio: thumbnail modifies in-place
+    logo_img.thumbnail((max_w, max_h), Image.LANCZOS)
+    # Same pixels as pasting the logo into a transparent box, without the empty margins
+    prepared = Image.new('RGBA', logo_img.size, (0, 0, 0, 0))
+    prepared.paste(logo_img, (0, 0), logo_img)
+    offset = ((max_w - logo_img.width) // 2, (max_h - logo_img.height) // 2)
+    return prepared, offset
+
+
+OUTPUT_MANIFEST = os.path.join(SCRIPT_DIR, '.poster_cache', 'outputs.json')
+
+
+class OutputManifest:
+    """Maps each output file to the input key it was rendered from.
+
+    An output is up to date when the file still exists and its recorded key matches the key of
+    the job that would produce it, so unchanged jobs can be skipped entirely."""
+
+    def __init__(self, path=OUTPUT_MANIFEST):
+        self.path = path
+        self._entries = {}
+        self._dirty = False
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def is_fresh(self, output, key):
+        output = os.path.abspath(output)
+        return self._entries.get(output) == key and os.path.exists(output)
+
+    def record(self, output, key):
+        self._entries[os.path.abspath(output)] = key
+        self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
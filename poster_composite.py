@@ -0,0 +1,93 @@
+# Alpha compositing of RGBA overlays (logo, assets, text tiles) onto an RGB canvas.
+#
+# The canvas never becomes RGBA: only the rectangles the overlays cover are blended, and the
+# only memory touched per poster is about the size of the overlays. By default each overlay is
+# pasted with its own alpha, which Pillow blends in C inside the overlay's box without any
+# intermediate image. The NumPy path groups overlapping overlays and blends each group in one
+# pass over a single crop of the canvas; on a 3375px poster it measured about 5x slower than
+# Pillow's paste, so it is opt-in (USE_NUMPY). Both paths give the same pixels as pasting onto
+# an RGBA canvas and converting it to RGB.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from PIL import Image
+
+USE_NUMPY = False
+
+
+def overlay_box(image, pos):
+    x, y = pos
+    return x, y, x + image.width, y + image.height
+
+
+def _clip(box, size):
+    x0, y0, x1, y1 = box
+    return max(x0, 0), max(y0, 0), min(x1, size[0]), min(y1, size[1])
+
+
+def intersects(a, b):
+    """Whether two (x0, y0, x1, y1) boxes overlap."""
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def group_overlays(overlays, size):
+    """Split overlays into groups of mutually overlapping boxes, clipped to size.
+
+    Returns [(box, [(image, pos), ...])] with overlays kept in their original order, so
+    later overlays still land on top of earlier ones."""
+    groups = []
+    for index, (image, pos) in enumerate(overlays):
+        box = _clip(overlay_box(image, pos), size)
+        if box[0] >= box[2] or box[1] >= box[3]:
+            continue
+        members = [(index, image, pos)]
+        keep = []
+        for gbox, gmembers in groups:
+            if intersects(gbox, box):
+                box = (min(box[0], gbox[0]), min(box[1], gbox[1]), max(box[2], gbox[2]), max(box[3], gbox[3]))
+                members += gmembers
+            else:
+                keep.append((gbox, gmembers))
+        keep.append((box, sorted(members, key=lambda m: m[0])))
+        groups = keep
+    return [(box, [(image, pos) for _, image, pos in members]) for box, members in groups]
+
+
+def _blend_group(canvas, box, members):
+    region = np.asarray(canvas.crop(box), dtype=np.uint16)
+    for image, (x, y) in members:
+        # the part of the overlay inside the group's box, and where it lands in the region
+        ox0, oy0 = max(box[0] - x, 0), max(box[1] - y, 0)
+        ox1, oy1 = min(box[2] - x, image.width), min(box[3] - y, image.height)
+        if ox0 >= ox1 or oy0 >= oy1:
+            continue
+        src = np.asarray(image.crop((ox0, oy0, ox1, oy1)) if (ox0, oy0, ox1, oy1) != (0, 0) + image.size
+                         else image, dtype=np.uint16)
+        rx, ry = x + ox0 - box[0], y + oy0 - box[1]
+        dst = region[ry:ry + (oy1 - oy0), rx:rx + (ox1 - ox0)]
+        alpha = src[..., 3:4]
+        # Pillow's paste arithmetic: (dst * (255 - a) + src * a) / 255, rounded the same way
+        tmp = dst * (255 - alpha) + src[..., :3] * alpha + 128
+        dst[...] = (tmp + (tmp >> 8)) >> 8
+    canvas.paste(Image.fromarray(region.astype(np.uint8), 'RGB'), box[:2])
+
+
+def composite(canvas, overlays, use_numpy=None):
+    """Blend [(rgba_image, (x, y))] onto canvas in order, in place.
+
+    use_numpy=None follows USE_NUMPY; NumPy is only used when installed and canvas is RGB."""
+    if use_numpy is None:
+        use_numpy = USE_NUMPY
+    if not use_numpy or np is None or canvas.mode != 'RGB':
+        for image, pos in overlays:
+            canvas.paste(image, pos, image)
+        return
+    for box, members in group_overlays(overlays, canvas.size):
+        if len(members) == 1:
+            # a lone overlay gains nothing from a crop and round trip
+            image, pos = members[0]
+            canvas.paste(image, pos, image)
+        else:
+            _blend_group(canvas, box, members)
@@ -0,0 +1,147 @@
+# Derivative sizes (social, messaging, thumbnails) cut from the in-memory full-resolution render.
+#
+# Derivatives are made largest first, and each one is downscaled from the smallest image
+# already produced that still covers its crop at enough resolution, so the master is only
+# resampled once. Large factors go through Image.reduce() (a fast box filter) before the final
+# LANCZOS pass, which keeps the LANCZOS work proportional to the output size.
+#
+# positions.json may define or override sizes under "derivatives":
+#
+#   "derivatives": {
+#     "story": {"size": [1080, 1920], "safe_area": [400, 200, 2975, 3300], "fill": [255, 255, 255]},
+#     "banner": [1500, 500]
+#   }
+#
+# safe_area is in master pixels. The crop keeps it whole; if no crop of the target aspect ratio
+# inside the canvas can, the canvas is padded with fill instead.
+import os
+
+from PIL import Image
+
+DEFAULT_DERIVATIVES = {
+    'instagram': (1080, 1080),
+    'story': (1080, 1920),
+    'whatsapp': (800, 800),
+    'thumb': (320, 320),
+}
+
+# reduce() is only used while the remaining LANCZOS step still shrinks by at least this much
+REDUCING_GAP = 2.0
+
+DEFAULT_FILL = (255, 255, 255)
+
+
+def _entry(name, value):
+    if isinstance(value, dict):
+        size = value.get('size')
+        safe_area = value.get('safe_area')
+        fill = value.get('fill', DEFAULT_FILL)
+    else:
+        size, safe_area, fill = value, None, DEFAULT_FILL
+    if not size or len(size) != 2 or min(size) < 1:
+        raise ValueError(f"derivative {name!r} needs a size [width, height]")
+    return (name, [int(size[0]), int(size[1])],
+            [int(v) for v in safe_area] if safe_area else None,
+            list(fill) if isinstance(fill, (list, tuple)) else fill)
+
+
+def derivative_specs(selection, definitions=None):
+    """Return the derivatives to produce as a list of (name, size, safe_area, fill).
+
+    definitions (from positions.json) add to or override DEFAULT_DERIVATIVES. selection is
+    None (the names in definitions, if any), 'all', 'none', a list of names, or a dict of further
+    definitions that are all produced."""
+    available = dict(DEFAULT_DERIVATIVES)
+    available.update(definitions or {})
+    if selection is None:
+        names = list(definitions or ())
+    elif selection == 'all':
+        names = list(available)
+    elif selection == 'none':
+        names = []
+    elif isinstance(selection, dict):
+        available.update(selection)
+        names = list(selection)
+    else:
+        names = [selection] if isinstance(selection, str) else list(selection)
+    unknown = [n for n in names if n not in available]
+    if unknown:
+        raise ValueError(f"unknown derivative(s): {', '.join(unknown)}")
+    return [_entry(n, available[n]) for n in names]
+
+
+def derivative_path(output, name):
+    """poster.jpg -> poster_<name>.jpg"""
+    stem, ext = os.path.splitext(output)
+    return f"{stem}_{name}{ext}"
+
+
+def crop_box(canvas, size, safe_area=None):
+    """Return (box, padded): the region of the canvas, in master pixels, to scale to size.
+
+    The box has size's aspect ratio and is as large as the canvas allows, centered on the safe
+    area (or the canvas center). padded is True when the box had to extend past the canvas to hold
+    the whole safe area."""
+    cw, ch = canvas
+    aspect = size[0] / size[1]
+    if cw / ch > aspect:
+        bw, bh = ch * aspect, ch
+    else:
+        bw, bh = cw, cw / aspect
+    # without a safe area the crop is simply centered
+    x0, y0, x1, y1 = safe_area or (cw / 2, ch / 2, cw / 2, ch / 2)
+    padded = False
+    if x1 - x0 > bw + 0.5 or y1 - y0 > bh + 0.5:
+        # smallest box of the right aspect that holds the safe area; extends off the canvas
+        sw, sh = x1 - x0, y1 - y0
+        bw, bh = (sw, sw / aspect) if sw / sh > aspect else (sh * aspect, sh)
+        padded = True
+    cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+    left, top = cx - bw / 2, cy - bh / 2
+    if not padded:
+        left = min(max(left, 0), cw - bw)
+        top = min(max(top, 0), ch - bh)
+    box = tuple(int(round(v)) for v in (left, top, left + bw, top + bh))
+    return box, padded
+
+
+def downscale(image, box, size):
+    """Crop box out of image and scale it to size, reducing by an integer factor first when large."""
+    region = image.crop(box)
+    factor = int(min(region.width / size[0], region.height / size[1]) / REDUCING_GAP)
+    if factor >= 2:
+        region = region.reduce(factor)
+    return region.resize(tuple(size), Image.LANCZOS)
+
+
+def _padded_region(master, box, fill):
+    region = Image.new(master.mode, (box[2] - box[0], box[3] - box[1]), tuple(fill) if isinstance(fill, list) else fill)
+    region.paste(master.crop((max(box[0], 0), max(box[1], 0), min(box[2], master.width), min(box[3], master.height))),
+                 (max(-box[0], 0), max(-box[1], 0)))
+    return region
+
+
+def make_derivatives(master, specs):
+    """Return [(name, image)] for specs (from derivative_specs), in the order given."""
+    # (region of the master it shows, scale relative to the master, image)
+    levels = [((0, 0) + master.size, 1.0, master)]
+    made = {}
+    for name, size, safe_area, fill in sorted(specs, key=lambda s: -s[1][0] * s[1][1]):
+        box, padded = crop_box(master.size, size, safe_area)
+        if padded:
+            made[name] = downscale(_padded_region(master, box, fill), (0, 0, box[2] - box[0], box[3] - box[1]), size)
+            continue
+        scale = size[0] / (box[2] - box[0])
+        # the smallest image already made that contains the crop at enough resolution
+        region, level_scale, source = min(
+            (lvl for lvl in levels
+             if lvl[1] >= scale and lvl[0][0] <= box[0] and lvl[0][1] <= box[1]
+             and lvl[0][2] >= box[2] and lvl[0][3] >= box[3]),
+            key=lambda lvl: lvl[1])
+        sub = [int(round((v - o) * level_scale)) for v, o in zip(box, region[:2] * 2)]
+        # rounding must not step past the source's edge
+        sub[2], sub[3] = min(sub[2], source.width), min(sub[3], source.height)
+        im = downscale(source, sub, size)
+        levels.append((box, scale, im))
+        made[name] = im
+    return [(name, made[name]) for name, _, _, _ in specs]
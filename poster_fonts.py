@@ -0,0 +1,159 @@
+import os
+import sys
+from collections import OrderedDict, namedtuple
+
+from PIL import ImageFont
+
+from poster_trace import stage
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+FONT_EXTS = ('.ttf', '.otf', '.ttc')
+
+# requested: the family/file asked for, path: the file actually used (None for PIL's default font)
+# fallback: None when the request was satisfied, 'regular' when a bold face was wanted but only the
+# base face exists, 'default' when nothing was found and PIL's built-in font is used
+FontResolution = namedtuple('FontResolution', 'requested bold path has_bold fallback')
+
+
+def default_font_dirs():
+    """Directories scanned for fonts: the script dir and assets/ first, then the platform font dirs."""
+    dirs = [SCRIPT_DIR, os.path.join(SCRIPT_DIR, 'assets')]
+    home = os.path.expanduser('~')
+    if sys.platform.startswith('win'):
+        windir = os.environ.get('WINDIR', r'C:\Windows')
+        dirs.append(os.path.join(windir, 'Fonts'))
+        local = os.environ.get('LOCALAPPDATA')
+        if local:
+            dirs.append(os.path.join(local, 'Microsoft', 'Windows', 'Fonts'))
+    elif sys.platform == 'darwin':
+        dirs += ['/System/Library/Fonts', '/Library/Fonts', os.path.join(home, 'Library', 'Fonts')]
+    else:
+        data_home = os.environ.get('XDG_DATA_HOME', os.path.join(home, '.local', 'share'))
+        dirs += ['/usr/share/fonts', '/usr/local/share/fonts',
+                 os.path.join(data_home, 'fonts'), os.path.join(home, '.fonts')]
+    return dirs
+
+
+def bold_candidates(name_no_ext, ext):
+    """Common bold file name patterns for a base font name."""
+    return [
+        name_no_ext + 'bd' + ext,
+        name_no_ext + '-bd' + ext,
+        name_no_ext + 'b' + ext,
+        name_no_ext + 'bold' + ext,
+        name_no_ext + '-bold' + ext,
+        'arialbd' + ext,
+        'DejaVuSans-Bold' + ext,
+    ]
+
+
+class FontRegistry:
+    """Resolves font names to files once and hands out loaded faces from an LRU.
+
+    The font directories are scanned on first use into a name -> path index, so resolving a
+    family never probes the filesystem again. Loaded faces are keyed by (family, size, bold)."""
+
+    def __init__(self, font_dirs=None, max_faces=64):
+        self.font_dirs = list(font_dirs) if font_dirs is not None else default_font_dirs()
+        self.max_faces = max_faces
+        self._index = None
+        self._resolutions = {}
+        self._faces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _scan(self):
+        index = {}
+        for root_dir in self.font_dirs:
+            if not os.path.isdir(root_dir):
+                continue
+            for dirpath, _, filenames in os.walk(root_dir):
+                for fn in filenames:
+                    if not fn.lower().endswith(FONT_EXTS):
+                        continue
+                    path = os.path.join(dirpath, fn)
+                    # first directory wins, so local fonts shadow system ones
+                    index.setdefault(fn.lower(), path)
+                    index.setdefault(os.path.splitext(fn)[0].lower(), path)
+        return index
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = self._scan()
+        return self._index
+
+    def find(self, name):
+        """Return the path for a font file name, bare name or explicit path, or None."""
+        if os.path.isfile(name):
+            return name
+        base = os.path.basename(name).lower()
+        return self.index.get(base) or self.index.get(os.path.splitext(base)[0])
+
+    def resolve(self, family, bold=False):
+        """Resolve family (a file name such as 'arial.ttf' or a path) to a FontResolution."""
+        key = (family, bold)
+        res = self._resolutions.get(key)
+        if res is not None:
+            return res
+        base_path = self.find(family)
+        res = None
+        if bold:
+            base_dir = os.path.dirname(family)
+            name_no_ext, ext = os.path.splitext(os.path.basename(family))
+            for cand in bold_candidates(name_no_ext, ext or '.ttf'):
+                path = self.find(os.path.join(base_dir, cand) if base_dir else cand)
+                if path:
+                    res = FontResolution(family, bold, path, True, None)
+                    break
+            if res is None and base_path:
+                res = FontResolution(family, bold, base_path, False, 'regular')
+        elif base_path:
+            res = FontResolution(family, bold, base_path, True, None)
+        if res is None:
+            res = FontResolution(family, bold, None, False, 'default')
+        self._resolutions[key] = res
+        return res
+
+    def seed(self, resolutions):
+        """Pre-load resolutions (e.g. from a compiled template) so they are never looked up again."""
+        for res in resolutions:
+            res = FontResolution(*res)
+            self._resolutions[(res.requested, res.bold)] = res
+
+    def get(self, family, size, bold=False):
+        """Return (font, has_bold_flag) for family at size, loading the face on first use."""
+        key = (family, size, bold)
+        entry = self._faces.get(key)
+        if entry is not None:
+            self._faces.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        res = self.resolve(family, bold)
+        font = None
+        if res.path:
+            try:
+                with stage('font_load', font=os.path.basename(res.path), size=size):
+                    font = ImageFont.truetype(res.path, size)
+            except OSError:
+                font = None
+        if font is None:
+            if res.path:
+                # the indexed file could not be loaded; remember it as a default fallback
+                res = self._resolutions[(family, bold)] = FontResolution(family, bold, res.path, False, 'default')
+            entry = (ImageFont.load_default(), False)
+        else:
+            entry = (font, res.has_bold)
+        self._faces[key] = entry
+        if len(self._faces) > self.max_faces:
+            self._faces.popitem(last=False)
+        return entry
+
+    def fallbacks(self):
+        """Return every resolution so far that did not get the font it asked for."""
+        return [res for res in self._resolutions.values() if res.fallback]
+
+
+# Shared per-process registry
+FONTS = FontRegistry()
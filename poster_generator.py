@@ -1,332 +1,972 @@
-from PIL import Image, ImageDraw, ImageFont
-import textwrap
-import json
-import os
-
-# Paths to input files
-background_path = "background.png"   # e.g., /mnt/data/7f55130d-2e71-42ed-80cd-d72dd2f0561d.jpeg
-logo_path = "logo.png"                # your WinVinaya Foundation logo
-text_file = "poster_text.txt"         # .txt file with numbered lines
-output_path = "generated_poster.jpg"
-
-# Font settings with bold support
-def try_load_font(path, size):
-    try:
-        return ImageFont.truetype(path, size)
-    except Exception:
-        return None
-
-
-def load_font_with_bold(base_path, size, want_bold=False):
-    """Try to load a font. If want_bold=True, try common bold variants and return (font, has_bold_flag).
-    Falls back to the base font or PIL default if not found."""
-    # Try exact path first
-    f = try_load_font(base_path, size)
-    base_dir = os.path.dirname(base_path)
-    basename = os.path.basename(base_path)
-    name_no_ext, ext = os.path.splitext(basename)
-    if f is None:
-        # try bare name (system font lookup)
-        f = try_load_font(name_no_ext + ext, size)
-    if not want_bold:
-        if f is None:
-            return ImageFont.load_default(), False
-        return f, True
-
-    # want bold: try common bold file name patterns
-    bold_candidates = [
-        name_no_ext + 'bd' + ext,
-        name_no_ext + '-bd' + ext,
-        name_no_ext + 'b' + ext,
-        name_no_ext + 'bold' + ext,
-        'arialbd' + ext,
-        'DejaVuSans-Bold' + ext,
-    ]
-    for cand in bold_candidates:
-        cand_path = os.path.join(base_dir, cand) if base_dir else cand
-        bf = try_load_font(cand_path, size)
-        if bf:
-            return bf, True
-
-    # No bold font found; return base or default and indicate bold is unavailable
-    if f is None:
-        return ImageFont.load_default(), False
-    return f, False
-
-
-# Load fonts (prefer bold variants where requested)
-title_font, _ = load_font_with_bold("arialbd.ttf", 160, want_bold=False)
-subtitle_font, subtitle_has_bold = load_font_with_bold("arial.ttf", 100, want_bold=True)
-body_font, body_has_bold = load_font_with_bold("arial.ttf", 80, want_bold=True)
-
-
-def draw_bold_text(draw_obj, pos, text, font, fill, bold_available=True, stroke=2):
-    """Draw text in bold. If a bold font is available, use it. Otherwise try stroke_width, then multi-draw fallback."""
-    x, y = pos
-    if bold_available:
-        draw_obj.text((x, y), text, font=font, fill=fill)
-        return
-    # Try stroke_width API (Pillow >= 5-ish)
-    try:
-        draw_obj.text((x, y), text, font=font, fill=fill, stroke_width=stroke, stroke_fill=fill)
-        return
-    except TypeError:
-        # Older Pillow may not support stroke_width
-        pass
-    # Fallback: draw the text multiple times with small offsets to emulate bold
-    offsets = [(-1, 0), (1, 0), (0, -1), (0, 1), (0, 0)]
-    for dx, dy in offsets:
-        draw_obj.text((x + dx, y + dy), text, font=font, fill=fill)
-
-
-# Load background
-bg = Image.open(background_path).convert("RGBA")
-draw = ImageDraw.Draw(bg)
-
-# Assets handling: load images from assets/ folder
-ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
-asset_files = []
-if os.path.isdir(ASSETS_DIR):
-    for fn in sorted(os.listdir(ASSETS_DIR)):
-        if fn.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif')):
-            asset_files.append(os.path.join(ASSETS_DIR, fn))
-
-
-# Load logo and paste into a fixed-size box (preserve aspect ratio)
-def paste_logo_fixed(bg_image, logo_file, box_size=(250, 250), gap=50):
-    """Paste the logo into a fixed-size box at bottom-right without skewing.
-
-    - box_size: (width, height) of the bounding box the logo should occupy
-    - margin: distance from the image edges to the bounding box
-    """
-    logo_img = Image.open(logo_file).convert("RGBA")
-    max_w, max_h = box_size
-
-    # Preserve aspect ratio: thumbnail modifies in-place
-    # Choose resampling filter compatible across Pillow versions
-    try:
-        resample = Image.Resampling.LANCZOS
-    except AttributeError:
-        # Pillow < 9 fallback: use LANCZOS if present, else nearest
-        resample = getattr(Image, 'LANCZOS', Image.NEAREST)
-    logo_img.thumbnail((max_w, max_h), resample)
-
-    # Create a transparent box of exact size and center the logo inside it
-    box = Image.new("RGBA", box_size, (0, 0, 0, 0))
-    offset_x = (max_w - logo_img.width) // 2
-    offset_y = (max_h - logo_img.height) // 2
-    box.paste(logo_img, (offset_x, offset_y), logo_img)
-
-    # Compute position for bottom-right with margin
-    pos_x = bg_image.width - gap - max_w
-    pos_y = bg_image.height - gap - max_h
-    bg_image.paste(box, (pos_x, pos_y), box)
-
-
-
-# Try to load positions.json and use coordinates if available
-positions_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "positions.json")
-positions = None
-logo_box = (250, 250)
-if os.path.exists(positions_file):
-    try:
-        with open(positions_file, 'r', encoding='utf-8') as pf:
-            pj = json.load(pf)
-            positions = pj.get('positions', {})
-            logo_box = tuple(pj.get('logo_size', logo_box))
-    except Exception:
-        positions = None
-
-# If a logo coordinate is provided explicitly (key 'logo' or '0'), paste centered there,
-# otherwise fall back to bottom-right fixed placement.
-def paste_logo_at_coordinate(bg_image, logo_file, coord, box_size=(250,250)):
-    logo_img = Image.open(logo_file).convert('RGBA')
-    max_w, max_h = box_size
-    try:
-        resample = Image.Resampling.LANCZOS
-    except AttributeError:
-        resample = getattr(Image, 'LANCZOS', Image.NEAREST)
-    logo_img.thumbnail((max_w, max_h), resample)
-    box = Image.new('RGBA', box_size, (0,0,0,0))
-    offset_x = (max_w - logo_img.width) // 2
-    offset_y = (max_h - logo_img.height) // 2
-    box.paste(logo_img, (offset_x, offset_y), logo_img)
-    # coord is bg-image pixel coordinate to center the box on
-    cx, cy = coord
-    pos_x = int(cx - max_w/2)
-    pos_y = int(cy - max_h/2)
-    bg_image.paste(box, (pos_x, pos_y), box)
-
-# Use positions if available
-if positions:
-    # check for explicit 'logo' or '0' key
-    if 'logo' in positions:
-        try:
-            coord = positions['logo']
-            paste_logo_at_coordinate(bg, logo_path, coord, box_size=logo_box)
-        except Exception:
-            paste_logo_fixed(bg, logo_path, box_size=logo_box, gap=50)
-    elif '0' in positions:
-        try:
-            coord = positions['0']
-            paste_logo_at_coordinate(bg, logo_path, coord, box_size=logo_box)
-        except Exception:
-            paste_logo_fixed(bg, logo_path, box_size=logo_box, gap=50)
-    else:
-        paste_logo_fixed(bg, logo_path, box_size=logo_box, gap=50)
-else:
-    paste_logo_fixed(bg, logo_path, box_size=logo_box, gap=50)
-
-# Read data from text file
-with open(text_file, "r", encoding="utf-8") as f:
-    lines = f.readlines()
-
-# Remove empty lines and clean text
-lines = [line.strip() for line in lines if line.strip()]
-
-# Example expected format:
-# 1. Title text
-# 2. Subtitle text
-# 3. Body paragraph
-# 4. Footer text
-
-# Assign dynamically
-title_text = lines[0] if len(lines) > 0 else ""
-subtitle_text = lines[1] if len(lines) > 1 else ""
-body_text = lines[2] if len(lines) > 2 else ""
-footer_text = lines[3] if len(lines) > 3 else ""
-
-# Center title
-def text_size(draw_obj, text, font):
-    # textbbox returns (left, top, right, bottom)
-    bbox = draw_obj.textbbox((0, 0), text, font=font)
-    width = bbox[2] - bbox[0]
-    height = bbox[3] - bbox[1]
-    return width, height
-
-# Title placement: use positions.json if available (key '1') else center near top
-title_w, title_h = text_size(draw, title_text, font=title_font)
-if positions and '1' in positions:
-    try:
-        tx, ty = positions['1']
-        draw_bold_text(draw, (tx - title_w/2, ty - title_h/2), title_text, title_font, fill=(0, 80, 180), bold_available=True)
-    except Exception:
-        draw_bold_text(draw, ((bg.width - title_w)/2, 150), title_text, title_font, fill=(0, 80, 180), bold_available=True)
-else:
-    draw_bold_text(draw, ((bg.width - title_w)/2, 150), title_text, title_font, fill=(0, 80, 180), bold_available=True)
-
-# Subtitle below title
-# Subtitle placement: use positions.json key '2' if available, else default below title
-subtitle_w, subtitle_h = text_size(draw, subtitle_text, font=subtitle_font)
-if positions and '2' in positions:
-    try:
-        sx, sy = positions['2']
-        draw_bold_text(draw, (sx - subtitle_w/2, sy - subtitle_h/2), subtitle_text, subtitle_font, fill=(220, 100, 0), bold_available=subtitle_has_bold)
-    except Exception:
-        draw_bold_text(draw, ((bg.width - subtitle_w)/2, 250), subtitle_text, subtitle_font, fill=(220, 100, 0), bold_available=subtitle_has_bold)
-else:
-    draw_bold_text(draw, ((bg.width - subtitle_w)/2, 250), subtitle_text, subtitle_font, fill=(220, 100, 0), bold_available=subtitle_has_bold)
-
-# Body text (wrapped)
-# Body text placement: use positions.json key '3' as top-left start if available
-line_width = 40
-if positions and '3' in positions:
-    try:
-        bx, by = positions['3']
-        offset_x = int(bx)
-        offset_y = int(by)
-        for line in textwrap.wrap(body_text, width=line_width):
-            draw.text((offset_x, offset_y), line, font=body_font, fill=(0, 0, 0))
-            offset_y += int(body_font.size * 1.2)
-    except Exception:
-        margin = 100
-        offset = 400
-        for line in textwrap.wrap(body_text, width=line_width):
-            draw.text((margin, offset), line, font=body_font, fill=(0, 0, 0))
-            offset += int(body_font.size * 1.2)
-else:
-    margin = 100
-    offset = 400
-    for line in textwrap.wrap(body_text, width=line_width):
-        draw.text((margin, offset), line, font=body_font, fill=(0, 0, 0))
-        offset += int(body_font.size * 1.2)
-
-# Footer (bottom center)
-# Footer placement: use positions.json key '4' if available, else bottom center
-footer_w, footer_h = text_size(draw, footer_text, font=subtitle_font)
-if positions and '4' in positions:
-    try:
-        fx, fy = positions['4']
-        draw.text((fx - footer_w/2, fy - footer_h/2), footer_text, fill=(80, 80, 80), font=subtitle_font)
-    except Exception:
-        draw.text(((bg.width - footer_w)/2, bg.height - 200), footer_text, fill=(80, 80, 80), font=subtitle_font)
-else:
-    draw.text(((bg.width - footer_w)/2, bg.height - 200), footer_text, fill=(80, 80, 80), font=subtitle_font)
-
-# Save final image (convert to RGB for JPEG)
-def place_assets(bg_image, files, max_width_ratio=0.4, max_height_ratio=0.4):
-    """Place assets on the poster:
-    - If 1 image: center it exactly at poster center.
-    - If 2 images: place them centered vertically, left and right of center.
-    - If >2: spread evenly across the horizontal center line.
-    Images are resized to fit within max_width_ratio * bg.width per image and max_height_ratio * bg.height.
-    """
-    n = len(files)
-    if n == 0:
-        return
-    bw, bh = bg_image.size
-    max_w = int(bw * max_width_ratio)
-    max_h = int(bh * max_height_ratio)
-
-    imgs = []
-    for f in files:
-        try:
-            im = Image.open(f).convert('RGBA')
-            im.thumbnail((max_w, max_h), Image.LANCZOS)
-            imgs.append(im)
-        except Exception:
-            continue
-
-    if not imgs:
-        return
-
-    center_x = bw // 2
-    center_y = bh // 2
-
-    if len(imgs) == 1:
-        im = imgs[0]
-        pos_x = center_x - im.width // 2
-        pos_y = center_y - im.height // 2
-        bg_image.paste(im, (pos_x, pos_y), im)
-        return
-
-    if len(imgs) == 2:
-        left = imgs[0]
-        right = imgs[1]
-        spacing = int(bw * 0.05)
-        pos_left_x = center_x - spacing//2 - left.width
-        pos_right_x = center_x + spacing//2
-        pos_y = center_y - max(left.height, right.height) // 2
-        bg_image.paste(left, (pos_left_x, pos_y), left)
-        bg_image.paste(right, (pos_right_x, pos_y), right)
-        return
-
-    # more than 2: distribute across center line
-    total = len(imgs)
-    # compute total width and spacing
-    total_imgs_w = sum(im.width for im in imgs)
-    available_w = int(bw * 0.8)
-    gap = max(10, (available_w - total_imgs_w) // (total - 1)) if total > 1 else 0
-    start_x = center_x - (total_imgs_w + gap*(total-1)) // 2
-    x = start_x
-    for im in imgs:
-        pos_y = center_y - im.height // 2
-        bg_image.paste(im, (int(x), int(pos_y)), im)
-        x += im.width + gap
-
-
-place_assets(bg, asset_files)
-
-final = bg.convert("RGB")
-final.save(output_path)
-print(f"✅ Poster saved as {output_path}")
+from PIL import Image
+import argparse
+import hashlib
+import json
+import math
+import os
+import time
+from collections import OrderedDict, namedtuple
+
+from poster_bundle import load_bundle
+from poster_cache import (BaseLayerCache, DEFAULT_MAX_BYTES, LogoCache, OutputManifest, TextRunCache,
+                          ThumbnailCache, base_layer_key, file_digest)
+from poster_composite import composite
+from poster_derivatives import derivative_path, derivative_specs, make_derivatives
+from poster_fonts import FONTS
+from poster_layout import centered_extent, largest_size, line_step, run_extent, wrap_text
+from poster_output import OutputStage, encoder_settings, extension_for, format_for_path, save_image
+from poster_trace import TRACER, format_summary, stage, write_chrome_trace
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Paths to input files
+background_path = "background.png"   # e.g., /mnt/data/7f55130d-2e71-42ed-80cd-d72dd2f0561d.jpeg
+logo_path = "logo.png"                # your WinVinaya Foundation logo
+text_file = "poster_text.txt"         # .txt file with numbered lines
+output_path = "generated_poster.jpg"
+positions_file = os.path.join(SCRIPT_DIR, "positions.json")
+ASSETS_DIR = os.path.join(SCRIPT_DIR, 'assets')
+
+DEFAULT_LOGO_BOX = (250, 250)
+
+# Part of every output cache key; bump it when a code change alters rendered output
+RENDER_VERSION = 3
+
+
+# Font settings with bold support
+def load_font_with_bold(base_path, size, want_bold=False):
+    """Load a font through the shared font registry. If want_bold=True, prefer a bold variant.
+    Returns (font, has_bold_flag); falls back to the base font or PIL default if not found."""
+    return FONTS.get(base_path, size, bold=want_bold)
+
+
+def font_warnings():
+    """Describe every font request that fell back to a different face."""
+    warnings = []
+    for res in FONTS.fallbacks():
+        if res.fallback == 'regular':
+            warnings.append(f"⚠️ No bold variant of {res.requested}; using {res.path} with emulated bold")
+        else:
+            warnings.append(f"⚠️ Font {res.requested} not found; using PIL default font")
+    return warnings
+
+
+# Auto-fitted text is never shrunk below this size (at full resolution)
+MIN_FONT_SIZE = 24
+
+# role -> (font file, size, want_bold)
+FONT_SPECS = {
+    'title': ("arialbd.ttf", 160, False),
+    'subtitle': ("arial.ttf", 100, True),
+    'body': ("arial.ttf", 80, True),
+}
+
+# Fonts are loaded once per process and reused for every poster; the font sizes -> fonts.
+# Every preview resize asks for a new scale, so only the most recent sets are kept.
+_FONTS = OrderedDict()
+FONT_SETS_KEPT = 8
+
+
+def load_fonts(scale=1.0):
+    """Return a dict of role -> (font, has_bold_flag), loading the fonts on first use.
+
+    scale < 1 gives proportionally smaller faces for proxy previews; scales that round to the
+    same sizes share one set."""
+    sizes = tuple(max(1, round(size * scale)) for _, size, _ in FONT_SPECS.values())
+    fonts = _FONTS.get(sizes)
+    if fonts is not None:
+        _FONTS.move_to_end(sizes)
+        return fonts
+    # Load fonts (prefer bold variants where requested)
+    with stage('fonts'):
+        fonts = {role: load_font_with_bold(name, px, want_bold=bold)
+                 for (role, (name, _, bold)), px in zip(FONT_SPECS.items(), sizes)}
+    # The title face is drawn as-is, never emboldened
+    fonts['title'] = (fonts['title'][0], True)
+    _FONTS[sizes] = fonts
+    if len(_FONTS) > FONT_SETS_KEPT:
+        _FONTS.popitem(last=False)
+    return fonts
+
+
+# Rasterized text runs and memoized text measurements, reused across posters
+TEXT_RUNS = TextRunCache()
+
+
+def text_tile(pos, text, font, fill, bold_available=True, stroke=2):
+    """Return (tile, (x, y)): the cached rasterized run for text at pos and where to paste it."""
+    x, y = pos
+    # Keep the sub-pixel part of the position so cached runs match a direct draw
+    frac_x, ix = math.modf(x)
+    frac_y, iy = math.modf(y)
+    frac = (round(frac_x, 2), round(frac_y, 2))
+    if bold_available:
+        tile, (dx, dy) = TEXT_RUNS.run(font, text, fill, frac=frac)
+    else:
+        # Try stroke_width API (Pillow >= 5-ish)
+        try:
+            tile, (dx, dy) = TEXT_RUNS.run(font, text, fill, stroke=stroke, frac=frac)
+        except TypeError:
+            # Older Pillow may not support stroke_width
+            # Fallback: draw the text multiple times with small offsets to emulate bold
+            offsets = [(-1, 0), (1, 0), (0, -1), (0, 1), (0, 0)]
+            tile, (dx, dy) = TEXT_RUNS.run(font, text, fill, offsets=offsets, frac=frac)
+    return tile, (int(ix) + dx, int(iy) + dy)
+
+
+def draw_bold_text(image, pos, text, font, fill, bold_available=True, stroke=2):
+    """Draw text in bold. If a bold font is available, use it. Otherwise try stroke_width, then multi-draw fallback.
+
+    Runs are rasterized once into TEXT_RUNS and pasted, so repeated titles and footers are not re-rendered."""
+    tile, dest = text_tile(pos, text, font, fill, bold_available, stroke)
+    image.paste(tile, dest, tile)
+
+
+def load_background(path):
+    # The canvas stays RGB; overlays are blended only where they cover it (see poster_composite)
+    with stage('decode'):
+        return Image.open(path).convert("RGB")
+
+
+# Logos resized per (logo file, box size)
+LOGOS = LogoCache()
+
+# Asset thumbnails, persisted across runs
+THUMBNAILS = ThumbnailCache()
+
+# Pre-composited background + logo + assets layers, shared by every poster of a campaign.
+# Batch workers each hold their own cache.
+BASE_LAYERS = BaseLayerCache()
+
+
+# Assets handling: load images from assets/ folder
+def list_asset_files(assets_dir=ASSETS_DIR):
+    asset_files = []
+    if os.path.isdir(assets_dir):
+        for fn in sorted(os.listdir(assets_dir)):
+            if fn.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp')):
+                asset_files.append(os.path.join(assets_dir, fn))
+    return asset_files
+
+
+# Load logo and paste into a fixed-size box (preserve aspect ratio)
+def paste_prepared_logo(bg_image, logo_file, box_size, box_pos):
+    """Paste the logo centered in the box at box_pos. Only the logo's own bounding box is composited."""
+    entry = LOGOS.get(logo_file, box_size)
+    logo_img, (offset_x, offset_y) = entry[0], entry[1]
+    bg_image.paste(logo_img, (box_pos[0] + offset_x, box_pos[1] + offset_y), logo_img)
+
+
+def paste_logo_fixed(bg_image, logo_file, box_size=(250, 250), gap=50):
+    """Paste the logo into a fixed-size box at bottom-right without skewing.
+
+    - box_size: (width, height) of the bounding box the logo should occupy
+    - margin: distance from the image edges to the bounding box
+    """
+    max_w, max_h = box_size
+    # Compute position for bottom-right with margin
+    pos_x = bg_image.width - gap - max_w
+    pos_y = bg_image.height - gap - max_h
+    paste_prepared_logo(bg_image, logo_file, box_size, (pos_x, pos_y))
+
+
+def load_positions(path=positions_file):
+    """Load positions.json and return (positions, logo_box). positions is None if the file is missing or invalid."""
+    positions = None
+    logo_box = DEFAULT_LOGO_BOX
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as pf:
+                pj = json.load(pf)
+                positions = pj.get('positions', {})
+                logo_box = tuple(pj.get('logo_size', logo_box))
+        except Exception:
+            positions = None
+    return positions, logo_box
+
+
+def load_derivatives(path=positions_file):
+    """Return the derivative size definitions from positions.json ('derivatives'), or None."""
+    try:
+        with open(path, 'r', encoding='utf-8') as pf:
+            return json.load(pf).get('derivatives')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+# If a logo coordinate is provided explicitly (key 'logo' or '0'), paste centered there,
+# otherwise fall back to bottom-right fixed placement.
+def paste_logo_at_coordinate(bg_image, logo_file, coord, box_size=(250,250)):
+    max_w, max_h = box_size
+    # coord is bg-image pixel coordinate to center the box on
+    cx, cy = coord
+    pos_x = int(cx - max_w/2)
+    pos_y = int(cy - max_h/2)
+    paste_prepared_logo(bg_image, logo_file, box_size, (pos_x, pos_y))
+
+
+def logo_box_position(size, positions, logo_box, gap=50, scale=1.0):
+    """Return the top-left corner of the logo box on a canvas of the given size.
+
+    An explicit 'logo' or '0' coordinate (full-resolution pixels, multiplied by scale) centers
+    the box there; otherwise, or if the coordinate is malformed, it sits bottom-right with gap."""
+    max_w, max_h = logo_box
+    coord = logo_coordinate(positions)
+    if coord is not None:
+        try:
+            cx, cy = coord
+            return int(cx * scale - max_w/2), int(cy * scale - max_h/2)
+        except Exception:
+            pass
+    return size[0] - gap - max_w, size[1] - gap - max_h
+
+
+def paste_logo(bg, logo_file, positions, logo_box):
+    # Use positions if available: explicit 'logo' or '0' key, else bottom-right fixed placement
+    pos = logo_box_position(bg.size, positions, logo_box, gap=50)
+    with stage('logo'):
+        paste_prepared_logo(bg, logo_file, logo_box, pos)
+
+
+def logo_coordinate(positions):
+    """Return the explicit logo coordinate from positions ('logo' or '0'), or None for the fixed placement."""
+    if positions:
+        if 'logo' in positions:
+            return positions['logo']
+        if '0' in positions:
+            return positions['0']
+    return None
+
+
+def read_text_lines(path):
+    # Read data from text file
+    with open(path, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+
+    # Remove empty lines and clean text
+    return [line.strip() for line in lines if line.strip()]
+
+
+# Center title
+def text_size(text, font):
+    # Memoized textbbox: (right - left, bottom - top)
+    return TEXT_RUNS.measure(font, text)
+
+
+# One positioned piece of text; key is the positions.json key it belongs to
+TextRun = namedtuple('TextRun', 'key pos text font fill bold_available')
+
+
+def layout_text_blocks(size, lines, positions, fonts, scale=1.0):
+    """Lay out title, subtitle, body and footer using positions keys '1'..'4' where available.
+
+    Returns a list of TextRun. positions and the fallback offsets are in full-resolution pixels
+    and are multiplied by scale, so a proxy render only needs fonts loaded at the same scale."""
+    width, height = size
+    title_font, _ = fonts['title']
+    subtitle_font, subtitle_has_bold = fonts['subtitle']
+    body_font, _ = fonts['body']
+
+    # Example expected format:
+    # 1. Title text
+    # 2. Subtitle text
+    # 3. Body paragraph
+    # 4. Footer text
+
+    # Assign dynamically
+    title_text = lines[0] if len(lines) > 0 else ""
+    subtitle_text = lines[1] if len(lines) > 1 else ""
+    body_text = lines[2] if len(lines) > 2 else ""
+    footer_text = lines[3] if len(lines) > 3 else ""
+
+    runs = []
+
+    margin = int(100 * scale)
+
+    # Title placement: use positions.json if available (key '1') else center near top
+    # Long titles are shrunk to fit the space around where they are centered
+    title_font, _ = fit_font(fonts, 'title', title_text, placement_fits(positions, '1', size, margin, scale), scale)
+    title_w, title_h = text_size(title_text, font=title_font)
+    title_pos = ((width - title_w)/2, 150 * scale)
+    if positions and '1' in positions:
+        try:
+            tx, ty = positions['1']
+            title_pos = (tx * scale - title_w/2, ty * scale - title_h/2)
+        except Exception:
+            pass
+    runs.append(TextRun('1', title_pos, title_text, title_font, (0, 80, 180), True))
+
+    # Subtitle below title
+    # Subtitle placement: use positions.json key '2' if available, else default below title
+    subtitle_font, subtitle_has_bold = fit_font(fonts, 'subtitle', subtitle_text,
+                                                placement_fits(positions, '2', size, margin, scale), scale)
+    subtitle_w, subtitle_h = text_size(subtitle_text, font=subtitle_font)
+    subtitle_pos = ((width - subtitle_w)/2, 250 * scale)
+    if positions and '2' in positions:
+        try:
+            sx, sy = positions['2']
+            subtitle_pos = (sx * scale - subtitle_w/2, sy * scale - subtitle_h/2)
+        except Exception:
+            pass
+    runs.append(TextRun('2', subtitle_pos, subtitle_text, subtitle_font, (220, 100, 0), subtitle_has_bold))
+
+    # Body text (wrapped by measured pixel width up to the right margin)
+    # Body text placement: use positions.json key '3' as top-left start if available
+    offset_x, offset_y = margin, int(400 * scale)
+    if positions and '3' in positions:
+        try:
+            bx, by = positions['3']
+            offset_x, offset_y = int(bx * scale), int(by * scale)
+        except Exception:
+            pass
+    for line in wrap_text(body_text, body_font, width - offset_x - margin, TEXT_RUNS):
+        runs.append(TextRun('3', (offset_x, offset_y), line, body_font, (0, 0, 0), True))
+        offset_y += line_step(body_font)
+
+    # Footer (bottom center)
+    # Footer placement: use positions.json key '4' if available, else bottom center
+    # The footer uses the subtitle face, shrunk on its own (not with the subtitle) when too wide
+    footer_font, _ = fit_font(fonts, 'subtitle', footer_text, placement_fits(positions, '4', size, margin, scale),
+                              scale)
+    footer_w, footer_h = text_size(footer_text, font=footer_font)
+    footer_pos = ((width - footer_w)/2, height - 200 * scale)
+    if positions and '4' in positions:
+        try:
+            fx, fy = positions['4']
+            footer_pos = (fx * scale - footer_w/2, fy * scale - footer_h/2)
+        except Exception:
+            pass
+    runs.append(TextRun('4', footer_pos, footer_text, footer_font, (80, 80, 80), True))
+    return runs
+
+
+def placement_fits(positions, key, size, margin, scale=1.0):
+    """Return fits(text, font): whether text laid out for positions[key] stays on the canvas.
+
+    Anchored text is centered on its anchor and must stay margin inside the sides of the canvas
+    and inside its top and bottom (footers sit close to the bottom edge). Text without an anchor
+    is centered across the canvas and only has to be narrower than the width minus the margins."""
+    width, height = size
+    try:
+        cx, cy = positions[key]
+        center = (cx * scale, cy * scale)
+    except Exception:
+        return lambda text, font: text_size(text, font)[0] <= width - 2 * margin
+
+    def fits(text, font):
+        x0, y0, x1, y1 = centered_extent(center, text, font, TEXT_RUNS)
+        return x0 >= margin and x1 <= width - margin and y0 >= 0 and y1 <= height
+    return fits
+
+
+def fit_font(fonts, role, text, fits, scale=1.0):
+    """Return fonts[role], or the same face shrunk (by bisection over sizes) until fits(text, font)."""
+    font, has_bold = fonts[role]
+    if not text or fits(text, font):
+        return font, has_bold
+    name, _, bold = FONT_SPECS[role]
+    size = largest_size(max(1, int(MIN_FONT_SIZE * scale)), font.size,
+                        lambda sz: fits(text, load_font_with_bold(name, sz, want_bold=bold)[0]))
+    return load_font_with_bold(name, size, want_bold=bold)[0], has_bold
+
+
+def canvas_size(job):
+    """Size of the job's background, read from the bundle or the image header only."""
+    if job.get('bundle'):
+        return load_bundle(job['bundle']).background.size
+    with Image.open(job['background']) as im:
+        return im.size
+
+
+ROLE_NAMES = {'1': 'title', '2': 'subtitle', '3': 'body', '4': 'footer'}
+
+
+def check_layout(job):
+    """Measure a resolved job's text against its canvas without rasterizing anything.
+
+    Returns a list of human-readable overflow problems (empty when everything fits)."""
+    width, height = canvas_size(job)
+    problems = []
+    for run in layout_text_blocks((width, height), job['lines'], job['positions'], load_fonts()):
+        if not run.text:
+            continue
+        x0, y0, x1, y1 = run_extent(run.pos, run.text, run.font, TEXT_RUNS)
+        if x0 < 0 or y0 < 0 or x1 > width or y1 > height:
+            problems.append(f"{ROLE_NAMES.get(run.key, run.key)} {run.text!r} overflows the {width}x{height} canvas "
+                            f"(spans {int(x0)},{int(y0)} to {int(x1)},{int(y1)})")
+    return problems
+
+
+def text_run_bbox(run):
+    """Pixel bounding box (x0, y0, x1, y1) covered by a TextRun when drawn."""
+    tile, (x, y) = text_tile(run.pos, run.text, run.font, run.fill, run.bold_available)
+    return x, y, x + tile.width, y + tile.height
+
+
+def draw_text_run(image, run, origin=(0, 0)):
+    """Draw a TextRun; origin is the canvas position of image's top-left corner."""
+    x, y = run.pos
+    draw_bold_text(image, (x - origin[0], y - origin[1]), run.text, run.font,
+                   fill=run.fill, bold_available=run.bold_available)
+
+
+def draw_text_blocks(bg, lines, positions, fonts):
+    """Draw title, subtitle, body and footer using positions keys '1'..'4' where available."""
+    runs = layout_text_blocks(bg.size, lines, positions, fonts)
+    composite(bg, [text_tile(run.pos, run.text, run.font, run.fill, run.bold_available) for run in runs])
+
+
+def place_assets(bg_image, files, max_width_ratio=0.4, max_height_ratio=0.4):
+    """Place assets on the poster:
+    - If 1 image: center it exactly at poster center.
+    - If 2 images: place them centered vertically, left and right of center.
+    - If >2: spread evenly across the horizontal center line.
+    Images are resized to fit within max_width_ratio * bg.width per image and max_height_ratio * bg.height.
+    """
+    composite(bg_image, asset_layout(bg_image.size, files, max_width_ratio, max_height_ratio))
+
+
+def asset_box(size, max_width_ratio=0.4, max_height_ratio=0.4):
+    """The box each asset thumbnail is fitted into on a canvas of size."""
+    return int(size[0] * max_width_ratio), int(size[1] * max_height_ratio)
+
+
+def asset_layout(size, files, max_width_ratio=0.4, max_height_ratio=0.4):
+    """Return [(thumbnail, (x, y))] for the assets placed on a canvas of size (see place_assets)."""
+    return [(im, pos) for _, im, pos in asset_placements(size, files, max_width_ratio, max_height_ratio)]
+
+
+def asset_placements(size, files, max_width_ratio=0.4, max_height_ratio=0.4):
+    """Like asset_layout, but returns [(path, thumbnail, (x, y))]; undecodable files are left out."""
+    n = len(files)
+    if n == 0:
+        return []
+    bw, bh = size
+
+    # Thumbnails come from the disk cache; misses are decoded in parallel
+    with stage('thumbnails', count=n):
+        thumbs = THUMBNAILS.load_many(files, asset_box(size, max_width_ratio, max_height_ratio))
+    paths = [f for f, im in zip(files, thumbs) if im is not None]
+    imgs = [im for im in thumbs if im is not None]
+
+    if not imgs:
+        return []
+
+    center_x = bw // 2
+    center_y = bh // 2
+
+    if len(imgs) == 1:
+        im = imgs[0]
+        pos_x = center_x - im.width // 2
+        pos_y = center_y - im.height // 2
+        return [(paths[0], im, (pos_x, pos_y))]
+
+    if len(imgs) == 2:
+        left = imgs[0]
+        right = imgs[1]
+        spacing = int(bw * 0.05)
+        pos_left_x = center_x - spacing//2 - left.width
+        pos_right_x = center_x + spacing//2
+        pos_y = center_y - max(left.height, right.height) // 2
+        return [(paths[0], left, (pos_left_x, pos_y)), (paths[1], right, (pos_right_x, pos_y))]
+
+    # more than 2: distribute across center line
+    total = len(imgs)
+    # compute total width and spacing
+    total_imgs_w = sum(im.width for im in imgs)
+    available_w = int(bw * 0.8)
+    gap = max(10, (available_w - total_imgs_w) // (total - 1)) if total > 1 else 0
+    start_x = center_x - (total_imgs_w + gap*(total-1)) // 2
+    x = start_x
+    placed = []
+    for path, im in zip(paths, imgs):
+        pos_y = center_y - im.height // 2
+        placed.append((path, im, (int(x), int(pos_y))))
+        x += im.width + gap
+    return placed
+
+
+def _same_file(a, b):
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return os.path.abspath(a) == os.path.abspath(b)
+
+
+def resolve_spec(spec=None):
+    """Fill a job spec with the module defaults.
+
+    Recognised keys: bundle, background, logo, text_file, lines, positions_file, positions,
+    logo_size, assets_dir, output, format, encoder, derivatives, strip_height. 'lines' overrides
+    text_file and 'positions'/'logo_size' override positions_file or the bundle; a 'background' or 'logo'
+    given with a bundle must be the file compiled into it (ValueError otherwise). 'derivatives' selects
+    extra downscaled outputs (see poster_derivatives.derivative_specs) and 'strip_height' renders
+    the poster in strips of that many rows (see poster_tiles).
+    """
+    spec = dict(spec or {})
+    if '_error' in spec:
+        # a jobs file line that could not be read (see iter_jobs)
+        raise ValueError(spec['_error'])
+    resolved = {
+        'bundle': spec.get('bundle'),
+        'background': spec.get('background', background_path),
+        'logo': spec.get('logo', logo_path),
+        'assets_dir': spec.get('assets_dir', ASSETS_DIR),
+        'output': spec.get('output', output_path),
+        'encoder': spec.get('encoder'),
+        'strip_height': spec.get('strip_height'),
+    }
+    resolved['format'] = (spec.get('format') or format_for_path(resolved['output'])).upper()
+    written_as = format_for_path(resolved['output'], 'PNG')
+    if resolved['strip_height'] and (resolved['format'] != 'PNG' or written_as != 'PNG'):
+        # strips are streamed into a PNG; never write one under another format's name
+        raise ValueError(f"strip rendering writes PNG only; name the output .png, not {resolved['output']}")
+    resolved['text_file'] = None if 'lines' in spec else spec.get('text_file', text_file)
+    resolved['positions_file'] = None
+    definitions = None
+    if resolved['bundle']:
+        # A compiled template carries its own background, logo and positions
+        bundle = load_bundle(resolved['bundle'])
+        # the bundle's pixels are what gets drawn, so a different file named next to it is a mistake
+        for key, source in (('background', bundle.background_source), ('logo', bundle.logo_source)):
+            if key in spec and source and not _same_file(spec[key], source):
+                raise ValueError(f"{key} {spec[key]!r} differs from the {source!r} compiled into bundle "
+                                 f"{resolved['bundle']!r}; recompile the bundle or drop the {key} key")
+        resolved['background'] = bundle.background_source
+        resolved['logo'] = bundle.logo_source or resolved['logo']
+        positions, logo_box = bundle.positions, bundle.logo_size
+    else:
+        resolved['positions_file'] = spec.get('positions_file', positions_file)
+        positions, logo_box = load_positions(resolved['positions_file'])
+        definitions = load_derivatives(resolved['positions_file'])
+    if 'positions' in spec:
+        positions = spec['positions']
+    if 'logo_size' in spec:
+        logo_box = spec['logo_size']
+    resolved['positions'] = positions
+    resolved['logo_size'] = tuple(logo_box)
+    if spec.get('derivatives') is None and (resolved['strip_height'] or is_animated_job(resolved)):
+        # derivatives are cut from one full still frame; the template's defaults are not made for
+        # strip or animated renders (asking for them explicitly is an error there)
+        resolved['derivatives'] = []
+    else:
+        resolved['derivatives'] = derivative_specs(spec.get('derivatives'), definitions)
+    if 'lines' in spec:
+        resolved['lines'] = [line.strip() for line in spec['lines'] if line and line.strip()]
+    else:
+        resolved['lines'] = read_text_lines(resolved['text_file'])
+    return resolved
+
+
+def font_files():
+    """Paths of the font files the renderer uses."""
+    paths = []
+    for name, _, bold in FONT_SPECS.values():
+        path = FONTS.resolve(name, bold).path
+        if path and path not in paths:
+            paths.append(path)
+    return paths
+
+
+def job_input_files(job):
+    """Every file a resolved job's output depends on (used by --watch)."""
+    if job.get('bundle'):
+        files = [job['bundle']]
+    else:
+        files = [job['background'], job['logo']]
+    files += list_asset_files(job['assets_dir'])
+    files += [f for f in (job.get('text_file'), job.get('positions_file')) if f]
+    return files + font_files()
+
+
+def job_input_key(job):
+    """Content hash of everything that determines a job's output bytes."""
+    h = hashlib.sha1(f"render-v{RENDER_VERSION}".encode('ascii'))
+    sources = [job['bundle']] if job.get('bundle') else [job['background'], job['logo']]
+    for path in sources + list_asset_files(job['assets_dir']) + font_files():
+        h.update(file_digest(path).encode('ascii') + b'\0')
+    fmt = job['format']
+    h.update(json.dumps([job['lines'], job['positions'], list(job['logo_size']), fmt,
+                         encoder_settings(fmt, job['encoder']), job['derivatives'], job['strip_height']],
+                        sort_keys=True, default=str).encode('utf-8'))
+    return h.hexdigest()
+
+
+def is_up_to_date(manifest, job, key):
+    """True if the manifest has job's output at key and every derivative file exists."""
+    return manifest.is_fresh(job['output'], key) and all(
+        os.path.exists(derivative_path(job['output'], d[0])) for d in job['derivatives'])
+
+
+def render_poster(spec=None):
+    """Render one poster described by spec (see resolve_spec) and return it as an RGB image."""
+    return render_job(resolve_spec(spec))
+
+
+def build_base_layer(job, asset_files, skip=()):
+    """Compose the static part of a poster: background, logo and assets.
+
+    Assets in skip keep their place in the layout but are not drawn (see poster_animate)."""
+    logo = job['logo']
+    if job.get('bundle'):
+        bundle = load_bundle(job['bundle'])
+        # convert() turns the read-only mapped RGBA pixels into a private, writable RGB layer
+        bg = bundle.background.convert('RGB')
+        if bundle.logo is not None and tuple(job['logo_size']) == bundle.logo_size:
+            logo = bundle.logo
+    else:
+        bg = load_background(job['background'])
+    paste_logo(bg, logo, job['positions'], job['logo_size'])
+    with stage('assets'):
+        if skip:
+            composite(bg, [(im, pos) for path, im, pos in asset_placements(bg.size, asset_files) if path not in skip])
+        else:
+            place_assets(bg, asset_files)
+    return bg
+
+
+def render_job(job):
+    """Render an already resolved job spec and return it as an RGB image."""
+    fonts = load_fonts()
+
+    # Start from a copy of the cached static layer so only the text is drawn per poster
+    asset_files = list_asset_files(job['assets_dir'])
+    source_key = load_bundle(job['bundle']).key if job.get('bundle') else None
+    key = base_layer_key(job['background'], job['logo'], asset_files,
+                         job['logo_size'], logo_coordinate(job['positions']),
+                         source_key=source_key)
+    def build():
+        with stage('base_layer'):
+            return build_base_layer(job, asset_files)
+
+    base = BASE_LAYERS.get_or_build(key, build)
+    # The one full-frame allocation per poster; the base layer is already RGB for the encoder
+    with stage('copy'):
+        bg = base.copy()
+    with stage('text'):
+        draw_text_blocks(bg, job['lines'], job['positions'], fonts)
+    return bg
+
+
+def render_outputs(job):
+    """Render job and return [(image, path)]: the poster, then each derivative cut from it."""
+    final = render_job(job)
+    outputs = [(final, job['output'])]
+    if job['derivatives']:
+        with stage('derivatives'):
+            for name, im in make_derivatives(final, job['derivatives']):
+                outputs.append((im, derivative_path(job['output'], name)))
+    return outputs
+
+
+def generate_poster(spec=None):
+    """Render a poster and save it to spec['output']. Returns an EncodeResult (path, format, bytes, timings)."""
+    job = resolve_spec(spec)
+    final = render_job(job)
+    return save_image(final, job['output'], job['format'], job['encoder'])
+
+
+# Batch mode: job specs are streamed from a JSONL file and rendered across a process pool
+def iter_jobs(jobs_file, output_dir=None, defaults=None):
+    """Yield job specs from a JSONL file, one JSON object per non-empty line.
+
+    Keys missing from a job are taken from defaults. Jobs without an 'output' key are named
+    poster_<line>.<ext> inside output_dir. A line that is not a JSON object is yielded as a
+    spec named <jobs file>:<line> that resolve_spec rejects, so it fails as a job of its own
+    and the lines after it still run."""
+    with open(jobs_file, 'r', encoding='utf-8') as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as e:
+                yield {'output': f"{os.path.basename(jobs_file)}:{lineno}", '_error': f"invalid JSON: {e}"}
+                continue
+            if not isinstance(job, dict):
+                yield {'output': f"{os.path.basename(jobs_file)}:{lineno}",
+                       '_error': f"expected a JSON object, got {type(job).__name__}"}
+                continue
+            spec = dict(defaults or {})
+            spec.update(job)
+            if 'output' not in spec:
+                ext = extension_for(spec['format']) if spec.get('format') else \
+                    '.png' if spec.get('strip_height') else '.jpg'
+                spec['output'] = os.path.join(output_dir or '.', f"poster_{lineno:04d}{ext}")
+            elif output_dir and not os.path.isabs(spec['output']):
+                spec['output'] = os.path.join(output_dir, spec['output'])
+            yield spec
+
+
+def _init_worker(cache_bytes=DEFAULT_MAX_BYTES, profile=False):
+    # Batch workers load the fonts up front; templates are loaded by the jobs routed to them
+    if profile:
+        TRACER.enable()
+    BASE_LAYERS.max_bytes = cache_bytes
+    load_fonts()
+
+
+def run_batch(jobs_file, workers=None, output_dir=None, cache_bytes=DEFAULT_MAX_BYTES,
+              defaults=None, manifest=None, memory_budget=None, proof=None):
+    """Render every job in jobs_file on worker processes. Returns (rendered, failed) counts.
+
+    Jobs are admitted while their estimated memory fits memory_budget (bytes, None for no
+    limit), routed to the worker that already caches their template, and identical jobs are
+    rendered once (see poster_scheduler). With a manifest (OutputManifest), jobs whose inputs
+    are unchanged since their output was written are skipped, and every new output is
+    recorded. When TRACER is enabled the workers profile their stages too and their events
+    are collected into it. proof is a path for contact sheets or a PDF of the rendered posters,
+    built from in-memory proxies as the batch runs (see poster_proof)."""
+    from poster_scheduler import run_batch as schedule
+    return schedule(jobs_file, workers, output_dir, cache_bytes, defaults, manifest, memory_budget, proof)
+
+
+def run_single(spec, manifest=None):
+    """Render one poster unless the manifest says its output is up to date. Returns True on success."""
+    try:
+        job = resolve_spec(spec)
+        key = job_input_key(job) if manifest is not None else None
+        if key and is_up_to_date(manifest, job, key):
+            print(f"⏭️ {job['output']} is up to date")
+            return True
+        if job['strip_height']:
+            with stage('render', output=job['output']):
+                done = [(0, render_striped(job))]
+        elif is_animated_job(job):
+            with stage('render', output=job['output']):
+                done = [(0, render_animated(job))]
+        else:
+            with stage('render', output=job['output']):
+                outputs = render_outputs(job)
+            done = _encode_outputs(job, outputs)
+    except Exception as e:
+        print(f"❌ {spec.get('output', output_path)}: {type(e).__name__}: {e}")
+        return False
+    if key:
+        manifest.record(job['output'], key)
+        manifest.save()
+    for warning in font_warnings():
+        print(warning)
+    for i, res in sorted(done, key=lambda d: d[0]):
+        if i == 0:
+            print(f"✅ Poster saved as {res.path} ({res.bytes_written / 1024:.0f} KB, encoded in {res.encode_seconds:.2f}s)")
+        else:
+            print(f"   ↳ {res.path} ({res.bytes_written / 1024:.0f} KB)")
+    return True
+
+
+def _encode_outputs(job, outputs):
+    # The poster and its derivatives are encoded in parallel; returns [(index, EncodeResult)]
+    with OutputStage(workers=len(outputs), max_pending=len(outputs)) as out_stage:
+        for i, (image, path) in enumerate(outputs):
+            out_stage.submit(image, path, job['format'], job['encoder'], tag=i)
+        out_stage.join()
+        done, errors = out_stage.drain()
+    if errors:
+        raise RuntimeError('; '.join(f"{path}: {error}" for _, path, error in errors))
+    return done
+
+
+def render_striped(job, on_strip=None):
+    """Render job strip by strip straight into its PNG output (see poster_tiles). Returns an EncodeResult."""
+    from poster_tiles import render_striped as render
+    return render(job, on_strip=on_strip)
+
+
+def is_animated_job(job):
+    """True if a resolved job is written as an animated GIF/WebP (see poster_animate)."""
+    from poster_animate import is_animated_job as animated
+    return animated(job)
+
+
+def render_animated(job, on_first_frame=None):
+    """Render an animated job straight into its GIF/WebP output (see poster_animate). Returns an EncodeResult."""
+    from poster_animate import render_animated as render
+    return render(job, on_first_frame=on_first_frame)
+
+
+def watched_files(jobs_file=None, defaults=None, output_dir=None):
+    """Every input file of the default poster or of every job in jobs_file (plus the jobs file)."""
+    files = set()
+    specs = iter_jobs(jobs_file, output_dir, defaults) if jobs_file else [dict(defaults or {})]
+    if jobs_file:
+        files.add(jobs_file)
+    try:
+        for spec in specs:
+            try:
+                job = resolve_spec(spec)
+            except Exception:
+                continue
+            files.update(job_input_files(job))
+            if job['assets_dir']:
+                files.add(job['assets_dir'])
+    except (OSError, ValueError):
+        pass
+    return files
+
+
+def _snapshot(files):
+    stamps = {}
+    for path in files:
+        try:
+            st = os.stat(path)
+            stamps[path] = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamps[path] = None
+    return stamps
+
+
+def run_watch(build, jobs_file=None, defaults=None, output_dir=None, interval=0.5, debounce=0.3):
+    """Call build() now and again whenever an input file changes, until interrupted.
+
+    Bursts of changes (editors often write several times) are folded into one rebuild that
+    starts once nothing has changed for debounce seconds. build() relies on the output
+    manifest to re-render only the jobs whose inputs changed."""
+    build()
+    files = watched_files(jobs_file, defaults, output_dir)
+    stamps = _snapshot(files)
+    print(f"👀 Watching {len(files)} file(s) for changes (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(interval)
+            current = _snapshot(files)
+            if current == stamps:
+                continue
+            # debounce: wait until the files stop changing
+            while True:
+                time.sleep(debounce)
+                settled = _snapshot(files)
+                if settled == current:
+                    break
+                current = settled
+            build()
+            # the jobs file or positions may now reference different inputs
+            files = watched_files(jobs_file, defaults, output_dir)
+            stamps = _snapshot(files)
+    except KeyboardInterrupt:
+        pass
+
+
+def run_check(jobs_file=None, defaults=None):
+    """Measure-only validation of the default poster or every job in jobs_file. Returns the problem count."""
+    jobs = iter_jobs(jobs_file, defaults=defaults) if jobs_file else [dict(defaults or {})]
+    checked = problems = 0
+    for spec in jobs:
+        checked += 1
+        try:
+            found = check_layout(resolve_spec(spec))
+        except Exception as e:
+            found = [f"{type(e).__name__}: {e}"]
+        for problem in found:
+            print(f"❌ {spec.get('output', output_path)}: {problem}")
+        problems += len(found)
+    print(f"Checked {checked} layout(s), {problems} problem(s)")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate posters from a background, logo, text and positions.json")
+    parser.add_argument('-o', '--output', default=None, help="output file for the single poster")
+    parser.add_argument('--bundle', default=None, help="render from a compiled template bundle")
+    parser.add_argument('--batch', metavar='JOBS_JSONL', help="render every job spec in a JSONL file")
+    parser.add_argument('--check', action='store_true',
+                        help="only measure the text layout of the poster (or every --batch job) and report overflow")
+    parser.add_argument('--derivatives', default=None, metavar='NAMES',
+                        help="also write these downscaled sizes: 'all', 'none' or a comma separated list "
+                             "(instagram, story, whatsapp, thumb or names defined in positions.json)")
+    parser.add_argument('--strip-height', type=int, default=None, metavar='ROWS',
+                        help="compose print-size posters in strips of ROWS rows and stream them into a PNG, "
+                             "so memory does not grow with the canvas (the output must be a .png)")
+    parser.add_argument('--proof', metavar='PATH', default=None,
+                        help="with --batch, also write a proof of the rendered posters: a multi-page PDF "
+                             "(PATH.pdf) or numbered contact sheets (PATH.jpg/.png)")
+    parser.add_argument('--force', action='store_true', help="render even when the output is up to date")
+    parser.add_argument('--watch', action='store_true', help="keep running and re-render when input files change")
+    parser.add_argument('--profile', metavar='TRACE_JSON', default=None,
+                        help="record per-stage timings and memory, write them as a Chrome trace and print a summary")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes for --batch (default: CPU count)")
+    parser.add_argument('--output-dir', default=None, help="directory for batch outputs")
+    parser.add_argument('--memory-mb', type=int, default=None,
+                        help="estimated memory the --batch jobs in flight may hold together, in MB "
+                             "(default: half of physical memory)")
+    parser.add_argument('--cache-mb', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="memory limit per process for cached background/logo/asset layers, in MB")
+    parser.add_argument('--format', choices=['jpeg', 'webp', 'png', 'gif'], default=None,
+                        help="output format (default: from the output file extension); GIF and WebP "
+                             "posters with animated assets are animated")
+    parser.add_argument('--quality', type=int, default=None, help="JPEG/WebP quality")
+    parser.add_argument('--subsampling', choices=['4:4:4', '4:2:2', '4:2:0'], default=None, help="JPEG chroma subsampling")
+    parser.add_argument('--progressive', action='store_true', help="write progressive JPEGs")
+    parser.add_argument('--optimize', action='store_true', help="optimize JPEG/PNG encoding (slower, smaller)")
+    parser.add_argument('--lossless', action='store_true', help="lossless WebP")
+    args = parser.parse_args(argv)
+    if args.proof and not args.batch:
+        parser.error("--proof needs --batch")
+
+    defaults = {}
+    if args.bundle:
+        defaults['bundle'] = args.bundle
+    if args.format:
+        defaults['format'] = args.format.upper()
+    encoder = {k: v for k, v in (('quality', args.quality), ('subsampling', args.subsampling),
+                                 ('progressive', args.progressive or None), ('optimize', args.optimize or None),
+                                 ('lossless', args.lossless or None)) if v is not None}
+    if encoder:
+        defaults['encoder'] = encoder
+    if args.strip_height:
+        defaults['strip_height'] = args.strip_height
+    if args.derivatives is not None:
+        # 'none' (or an empty list) turns off the derivatives positions.json asks for
+        defaults['derivatives'] = args.derivatives if args.derivatives in ('all', 'none') else \
+            [n.strip() for n in args.derivatives.split(',') if n.strip()]
+
+    if args.check:
+        return 1 if run_check(args.batch, defaults) else 0
+
+    # Outputs are skipped when every input is unchanged since they were written
+    manifest = None if args.force else OutputManifest()
+
+    if args.batch:
+        if args.memory_mb is not None:
+            memory_budget = args.memory_mb * 1024 * 1024
+        else:
+            from poster_scheduler import default_memory_budget
+            memory_budget = default_memory_budget()
+
+        def build():
+            _, failed = run_batch(args.batch, workers=args.workers, output_dir=args.output_dir,
+                                  cache_bytes=args.cache_mb * 1024 * 1024, defaults=defaults,
+                                  manifest=manifest, memory_budget=memory_budget, proof=args.proof)
+            return failed == 0
+    else:
+        BASE_LAYERS.max_bytes = args.cache_mb * 1024 * 1024
+        spec = dict(defaults)
+        if args.output:
+            spec['output'] = args.output
+        elif 'format' in defaults:
+            spec['output'] = os.path.splitext(output_path)[0] + extension_for(defaults['format'])
+
+        def build():
+            return run_single(spec, manifest)
+
+    if args.profile:
+        TRACER.enable()
+        untraced = build
+
+        def build():
+            ok = untraced()
+            events = TRACER.drain()
+            write_chrome_trace(args.profile, events)
+            print(format_summary(events))
+            print(f"📈 Trace with {len(events)} event(s) written to {args.profile}")
+            return ok
+
+    if args.watch:
+        run_watch(build, args.batch, defaults, args.output_dir)
+        return 0
+    return 0 if build() else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,85 @@
+# Pixel-accurate text layout: wrapping by measured width and auto-fitting font sizes.
+#
+# Everything here works from memoized measurements (TextRunCache.length / .bbox) and never
+# rasterizes text, so layouts can be validated for overflow in bulk.
+
+
+def wrap_text(text, font, max_width, cache):
+    """Greedy word wrap of text so that every line is at most max_width pixels wide.
+
+    A single word wider than max_width is kept on a line of its own (and will overflow)."""
+    lines = []
+    current = ''
+    for word in text.split():
+        candidate = f"{current} {word}" if current else word
+        if not current or cache.length(font, candidate) <= max_width:
+            current = candidate
+        else:
+            lines.append(current)
+            current = word
+    if current:
+        lines.append(current)
+    return lines
+
+
+def line_step(font, line_spacing=1.2):
+    return int(font.size * line_spacing)
+
+
+def block_extent(lines, font, cache, line_spacing=1.2):
+    """Return (width, height) of lines drawn one below the other with line_spacing."""
+    if not lines:
+        return 0, 0
+    width = max(cache.measure(font, line)[0] for line in lines)
+    last_h = cache.bbox(font, lines[-1])[3]
+    return width, line_step(font, line_spacing) * (len(lines) - 1) + last_h
+
+
+def fits(text, font, max_width, max_height, cache, wrap=False, line_spacing=1.2):
+    if wrap:
+        lines = wrap_text(text, font, max_width, cache)
+        if any(cache.length(font, line) > max_width for line in lines):
+            return False
+        _, h = block_extent(lines, font, cache, line_spacing)
+        return max_height is None or h <= max_height
+    w, h = cache.measure(font, text)
+    return w <= max_width and (max_height is None or h <= max_height)
+
+
+def largest_size(lo, hi, ok):
+    """Return the largest size in [lo, hi] for which ok(size) holds, found by bisection.
+
+    ok must only get worse as the size grows. If even lo is not ok, lo is returned."""
+    if hi <= lo or ok(hi):
+        return max(lo, hi)
+    best = lo
+    lo_size, hi_size = lo, hi - 1
+    while lo_size <= hi_size:
+        mid = (lo_size + hi_size) // 2
+        if ok(mid):
+            best = mid
+            lo_size = mid + 1
+        else:
+            hi_size = mid - 1
+    return best
+
+
+def fit_font_size(load_font, text, max_width, max_height, lo, hi, cache, wrap=False, line_spacing=1.2):
+    """Return the largest size in [lo, hi] at which text fits the box, found by bisection.
+
+    load_font(size) returns a font at that size. If even lo does not fit, lo is returned."""
+    return largest_size(lo, hi, lambda size: fits(text, load_font(size), max_width, max_height, cache,
+                                                  wrap, line_spacing))
+
+
+def centered_extent(center, text, font, cache):
+    """Pixel box text covers when its measured box is centered on center, as anchored text is."""
+    w, h = cache.measure(font, text)
+    return run_extent((center[0] - w / 2, center[1] - h / 2), text, font, cache)
+
+
+def run_extent(pos, text, font, cache):
+    """Pixel box (x0, y0, x1, y1) text would cover when drawn at pos, without rasterizing it."""
+    left, top, right, bottom = cache.bbox(font, text)
+    x, y = pos
+    return x + left, y + top, x + right, y + bottom
@@ -0,0 +1,193 @@
+import io
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from poster_trace import stage
+
+# format -> default keyword arguments for Image.save(); JPEG matches Pillow's own defaults
+DEFAULT_SETTINGS = {
+    'JPEG': {'quality': 75, 'subsampling': '4:2:0', 'progressive': False, 'optimize': False},
+    'WEBP': {'quality': 80, 'method': 4, 'lossless': False},
+    'PNG': {'compress_level': 6, 'optimize': False},
+    'GIF': {'optimize': False},
+}
+
+EXTENSIONS = {
+    '.jpg': 'JPEG',
+    '.jpeg': 'JPEG',
+    '.webp': 'WEBP',
+    '.png': 'PNG',
+    '.gif': 'GIF',
+}
+
+# new files get the usual umask-derived mode rather than mkstemp's 0600
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+EncodeResult = namedtuple('EncodeResult', 'path format bytes_written encode_seconds write_seconds')
+
+
+def extension_for(fmt):
+    return {'JPEG': '.jpg', 'WEBP': '.webp', 'PNG': '.png', 'GIF': '.gif'}.get(fmt.upper(), '.' + fmt.lower())
+
+
+def format_for_path(path, default='JPEG'):
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower(), default)
+
+
+def encoder_settings(fmt, overrides=None):
+    """Merge per-format overrides onto the defaults. overrides may be flat ({'quality': 90})
+    or keyed by format ({'JPEG': {...}, 'WEBP': {...}}); only keys valid for fmt are kept."""
+    settings = dict(DEFAULT_SETTINGS.get(fmt, {}))
+    if overrides:
+        per_format = overrides.get(fmt) or overrides.get(fmt.lower())
+        if isinstance(per_format, dict):
+            settings.update(per_format)
+        for k, v in overrides.items():
+            if not isinstance(v, dict) and k in settings:
+                settings[k] = v
+    return settings
+
+
+def encode_image(image, fmt='JPEG', settings=None):
+    """Encode image to bytes in fmt using the merged settings."""
+    fmt = fmt.upper()
+    if fmt == 'JPG':
+        fmt = 'JPEG'
+    if fmt == 'JPEG' and image.mode not in ('RGB', 'L', 'CMYK'):
+        image = image.convert('RGB')
+    buf = io.BytesIO()
+    with stage('encode', format=fmt):
+        image.save(buf, fmt, **encoder_settings(fmt, settings))
+    return buf.getvalue()
+
+
+def save_image(image, path, fmt=None, settings=None):
+    """Encode image and write it to path. Returns an EncodeResult."""
+    fmt = (fmt or format_for_path(path)).upper()
+    start = time.perf_counter()
+    data = encode_image(image, fmt, settings)
+    encoded = time.perf_counter()
+    out_dir = os.path.dirname(path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    with stage('write', bytes=len(data)), open(path, 'wb') as f:
+        f.write(data)
+    return EncodeResult(path, fmt, len(data), encoded - start, time.perf_counter() - encoded)
+
+
+class StreamedFile:
+    """An output file written piece by piece under a temporary name in its own directory, and
+    moved over path only when the with block finishes without an error. write() counts the
+    bytes and the seconds spent writing them."""
+
+    def __init__(self, path):
+        self.path = path
+        out_dir = os.path.dirname(os.path.abspath(path))
+        os.makedirs(out_dir, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=out_dir, suffix='.tmp')
+        self.file = os.fdopen(fd, 'wb')
+        self.bytes = 0
+        self.write_seconds = 0.0
+
+    def write(self, data):
+        start = time.perf_counter()
+        self.file.write(data)
+        self.write_seconds += time.perf_counter() - start
+        self.bytes += len(data)
+
+    def patch(self, offset, data):
+        """Overwrite bytes already written, e.g. a length field known only at the end."""
+        self.file.seek(offset)
+        self.file.write(data)
+        self.file.seek(0, os.SEEK_END)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.file.close()
+        if exc_type is None:
+            os.chmod(self.tmp_path, 0o666 & ~_UMASK)
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+
+
+class OutputStage:
+    """Encodes and writes rendered frames on a thread pool.
+
+    Frames arrive through a bounded queue: submit() blocks once max_pending frames are waiting,
+    so a fast renderer cannot pile up full-size images in memory. Pillow releases the GIL while
+    encoding, so rendering the next poster overlaps encoding and writing the previous one."""
+
+    def __init__(self, workers=2, max_pending=2, on_result=None, on_error=None):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self.on_result = on_result
+        self.on_error = on_error
+        self.results = []
+        self.errors = []
+        self._threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(workers)]
+        for t in self._threads:
+            t.start()
+        self._closed = False
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                image, path, fmt, settings, tag = item
+                try:
+                    result = save_image(image, path, fmt, settings)
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                    with self._lock:
+                        self.errors.append((tag, path, error))
+                    if self.on_error:
+                        self.on_error(tag, path, error)
+                    continue
+                with self._lock:
+                    self.results.append((tag, result))
+                if self.on_result:
+                    self.on_result(tag, result)
+            finally:
+                self._queue.task_done()
+
+    def submit(self, image, path, fmt=None, settings=None, tag=None):
+        """Queue image for encoding to path; blocks while the queue is full."""
+        if self._closed:
+            raise RuntimeError("output stage is closed")
+        self._queue.put((image, path, fmt, settings, tag))
+
+    def join(self):
+        """Wait until every submitted frame has been written."""
+        self._queue.join()
+
+    def drain(self):
+        """Return and forget the (results, errors) collected so far."""
+        with self._lock:
+            results, errors = self.results, self.errors
+            self.results, self.errors = [], []
+        return results, errors
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,219 +1,597 @@
-import json
-import os
-import tkinter as tk
-from tkinter import filedialog, messagebox
-from PIL import Image, ImageTk
-
-# Config
-BACKGROUND = "background.png"
-TEXT_FILE = "poster_text.txt"
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-POSITIONS_FILE = os.path.join(SCRIPT_DIR, "positions.json")
-LOGO_SIZE = (250, 250)
-
-
-def load_text_lines(path):
-    if not os.path.exists(path):
-        return []
-    with open(path, 'r', encoding='utf-8') as f:
-        lines = [l.strip() for l in f.readlines() if l.strip()]
-    return lines
-
-
-class PosterPlacer(tk.Tk):
-    def __init__(self, background_path=BACKGROUND, text_file=TEXT_FILE):
-        super().__init__()
-        self.title("Poster Placer")
-        self.geometry("1000x700")
-
-        self.background_path = background_path
-        self.text_file = text_file
-        self.lines = load_text_lines(self.text_file)
-        self.num_items = len(self.lines)
-        self.positions = {}  # index -> (x,y)
-
-        self.canvas = tk.Canvas(self, bg="#ddd")
-        self.canvas.pack(fill=tk.BOTH, expand=True)
-
-        self.toolbar = tk.Frame(self)
-        self.toolbar.pack(fill=tk.X)
-
-        self.save_btn = tk.Button(self.toolbar, text="Save Positions", command=self.save_positions)
-        self.save_btn.pack(side=tk.LEFT)
-
-        self.load_bg_btn = tk.Button(self.toolbar, text="Load Background", command=self.load_background_dialog)
-        self.load_bg_btn.pack(side=tk.LEFT)
-
-        self.place_logo_btn = tk.Button(self.toolbar, text="Place Logo", command=self.enter_logo_mode)
-        self.place_logo_btn.pack(side=tk.LEFT)
-
-        self.clear_btn = tk.Button(self.toolbar, text="Clear Positions", command=self.clear_positions)
-        self.clear_btn.pack(side=tk.LEFT)
-
-        self.instructions = tk.Label(self.toolbar, text=f"Click to place items 1..{self.num_items}. Current: 1")
-        self.instructions.pack(side=tk.LEFT, padx=10)
-
-        self.bind('<Configure>', self.on_resize)
-        self.canvas.bind('<Button-1>', self.on_click)
-
-        self.bg_image = None
-        self.bg_tk = None
-        self.bg_photo_id = None
-
-        self.current_index = 1
-        self.logo_mode = False
-
-        self.load_background(self.background_path)
-        self.draw_rulers()
-        self.redraw()
-
-    def load_background_dialog(self):
-        fp = filedialog.askopenfilename(title="Select background image", filetypes=[("Image files", "*.png;*.jpg;*.jpeg;*.bmp")])
-        if fp:
-            self.background_path = fp
-            self.load_background(fp)
-            self.redraw()
-
-    def load_background(self, path):
-        if not os.path.exists(path):
-            # create placeholder background
-            self.bg_image = Image.new('RGBA', (1200, 800), (255, 255, 255, 255))
-        else:
-            self.bg_image = Image.open(path).convert('RGBA')
-        self.bg_tk = ImageTk.PhotoImage(self.bg_image)
-
-    def draw_rulers(self):
-        # Rulers are drawn on canvas on redraw
-        pass
-
-    def on_resize(self, event):
-        self.redraw()
-
-    def redraw(self):
-        self.canvas.delete('all')
-        # Draw background centered or fitted
-        w = self.canvas.winfo_width()
-        h = self.canvas.winfo_height()
-        if w <= 1 or h <= 1:
-            self.after(50, self.redraw)
-            return
-
-        # fit bg_image to canvas while preserving aspect
-        bg_w, bg_h = self.bg_image.size
-        scale = min(w / bg_w, h / bg_h)
-        new_w = int(bg_w * scale)
-        new_h = int(bg_h * scale)
-        resized = self.bg_image.resize((new_w, new_h), Image.LANCZOS)
-        self.bg_tk = ImageTk.PhotoImage(resized)
-        self.bg_photo_id = self.canvas.create_image((w//2, h//2), image=self.bg_tk)
-
-        # Store transform for converting clicks
-        self.offset_x = (w - new_w) // 2
-        self.offset_y = (h - new_h) // 2
-        self.display_w = new_w
-        self.display_h = new_h
-
-        # Draw rulers
-        self.draw_rulers_lines()
-
-        # Draw existing positions
-        for key, pos in self.positions.items():
-            # key may be numeric string ("1","2",...) or 'logo'
-            try:
-                label = int(key)
-            except Exception:
-                label = key
-            # convert stored absolute bg coordinate to display coords
-            x, y = pos
-            disp_x = int(x * scale) + self.offset_x
-            disp_y = int(y * scale) + self.offset_y
-            self.draw_marker(disp_x, disp_y, label)
-
-        # If current index not placed yet, optionally hint
-        self.instructions.config(text=f"Click to place items 1..{self.num_items}. Current: {self.current_index}")
-
-    def draw_rulers_lines(self):
-        # horizontal ruler
-        for i in range(0, self.display_w, 50):
-            x = self.offset_x + i
-            self.canvas.create_line(x, self.offset_y, x, self.offset_y + 10, fill='#222')
-            if i % 100 == 0:
-                self.canvas.create_text(x+2, self.offset_y+20, text=str(i), anchor='n', font=('Arial', 8))
-        # vertical ruler
-        for j in range(0, self.display_h, 50):
-            y = self.offset_y + j
-            self.canvas.create_line(self.offset_x, y, self.offset_x + 10, y, fill='#222')
-            if j % 100 == 0:
-                self.canvas.create_text(self.offset_x+20, y+2, text=str(j), anchor='w', font=('Arial', 8))
-
-    def draw_marker(self, x, y, idx):
-        r = 8
-        self.canvas.create_oval(x-r, y-r, x+r, y+r, fill='red')
-        # If idx is 'logo' or another string, show a short label
-        label = str(idx)
-        if label.lower() == 'logo':
-            display = 'L'
-        else:
-            display = label
-        self.canvas.create_text(x+12, y, text=display, anchor='w', font=('Arial', 12), fill='black')
-
-    def on_click(self, event):
-        # If click outside bg area, ignore
-        if event.x < self.offset_x or event.x > self.offset_x + self.display_w:
-            return
-        if event.y < self.offset_y or event.y > self.offset_y + self.display_h:
-            return
-
-        # convert display coords to bg image coords
-        scale = self.display_w / self.bg_image.size[0]
-        bg_x = int((event.x - self.offset_x) / scale)
-        bg_y = int((event.y - self.offset_y) / scale)
-
-        # If in logo placement mode, save under 'logo' key and exit logo mode
-        if self.logo_mode:
-            self.positions['logo'] = (bg_x, bg_y)
-            self.draw_marker(event.x, event.y, 'logo')
-            self.logo_mode = False
-            self.instructions.config(text=f"Click to place items 1..{self.num_items}. Current: {self.current_index}")
-            messagebox.showinfo("Logo placed", "Logo position saved.")
-            return
-
-        # Save position for current index (numeric items)
-        if self.current_index <= self.num_items:
-            self.positions[str(self.current_index)] = (bg_x, bg_y)
-            self.draw_marker(event.x, event.y, self.current_index)
-            self.current_index += 1
-            if self.current_index > self.num_items:
-                messagebox.showinfo("Done", "All items placed. Positions will be auto-saved.")
-                # auto-save when complete
-                try:
-                    self.save_positions()
-                except Exception as e:
-                    messagebox.showerror('Save Error', f'Could not auto-save positions: {e}')
-        else:
-            messagebox.showinfo("Info", "All items already placed")
-
-    def enter_logo_mode(self):
-        self.logo_mode = True
-        self.instructions.config(text="Click on the background to place the logo (will be saved under key 'logo')")
-
-    def save_positions(self):
-        data = {
-            'background': self.background_path,
-            'lines': self.lines,
-            'positions': self.positions,
-            'logo_size': LOGO_SIZE
-        }
-        with open(POSITIONS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        messagebox.showinfo('Saved', f'Positions saved to {POSITIONS_FILE}')
-
-    def clear_positions(self):
-        self.positions = {}
-        self.current_index = 1
-        self.redraw()
-
-
-if __name__ == '__main__':
-    app = PosterPlacer()
-    app.mainloop()
+import json
+import os
+import threading
+import tkinter as tk
+from tkinter import filedialog, messagebox
+from PIL import Image, ImageTk
+
+import poster_generator as gen
+from poster_composite import intersects
+
+# Config
+BACKGROUND = "background.png"
+TEXT_FILE = "poster_text.txt"
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+POSITIONS_FILE = os.path.join(SCRIPT_DIR, "positions.json")
+LOGO_SIZE = (250, 250)
+# Wait this long after the last <Configure> event before the full-quality redraw
+RESIZE_DEBOUNCE_MS = 150
+# Smallest pyramid level kept, in pixels along the shorter side
+PYRAMID_MIN_SIZE = 256
+# Marker radius and hit-test grid cell, in display pixels
+MARKER_RADIUS = 8
+HIT_CELL = 32
+# Position edits kept for undo
+UNDO_LIMIT = 200
+
+
+def load_text_lines(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = [l.strip() for l in f.readlines() if l.strip()]
+    return lines
+
+
+def build_pyramid(image, min_size=PYRAMID_MIN_SIZE):
+    """Return [image, image/2, image/4, ...] down to min_size on the shorter side.
+
+    Each level is made with reduce(2) from the previous one, which is a cheap box filter."""
+    levels = [image]
+    while min(levels[-1].size) // 2 >= min_size:
+        levels.append(levels[-1].reduce(2))
+    return levels
+
+
+def pick_level(levels, target_w, target_h):
+    """Return the smallest pyramid level that is still at least target_w x target_h."""
+    best = levels[0]
+    for level in levels:
+        if level.width >= target_w and level.height >= target_h:
+            best = level
+        else:
+            break
+    return best
+
+
+class SpatialGrid:
+    """Uniform grid of boxes for hit testing. Inserting, moving or removing a box only touches
+    the few cells it covers, so dragging one marker costs the same however many there are."""
+
+    def __init__(self, cell=HIT_CELL):
+        self.cell = cell
+        self._cells = {}
+        self._boxes = {}
+
+    def _cells_for(self, box):
+        c = self.cell
+        for cx in range(int(box[0] // c), int(box[2] // c) + 1):
+            for cy in range(int(box[1] // c), int(box[3] // c) + 1):
+                yield cx, cy
+
+    def insert(self, key, box):
+        """Add key with box (x0, y0, x1, y1), replacing its previous box."""
+        self.remove(key)
+        self._boxes[key] = box
+        for cell in self._cells_for(box):
+            self._cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        box = self._boxes.pop(key, None)
+        if box is None:
+            return
+        for cell in self._cells_for(box):
+            keys = self._cells.get(cell)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._cells[cell]
+
+    def clear(self):
+        self._cells.clear()
+        self._boxes.clear()
+
+    def hit(self, x, y):
+        """Return the key whose box contains (x, y), preferring the nearest center, or None."""
+        best, best_dist = None, None
+        for key in self._cells.get((int(x // self.cell), int(y // self.cell)), ()):
+            x0, y0, x1, y1 = self._boxes[key]
+            if x0 <= x <= x1 and y0 <= y <= y1:
+                dist = ((x0 + x1) / 2 - x) ** 2 + ((y0 + y1) / 2 - y) ** 2
+                if best is None or dist < best_dist:
+                    best, best_dist = key, dist
+        return best
+
+
+class History:
+    """Undo/redo for position edits. An entry is a list of (key, before, after); None means unplaced."""
+
+    def __init__(self, limit=UNDO_LIMIT):
+        self.limit = limit
+        self._undo = []
+        self._redo = []
+
+    def record(self, changes):
+        changes = [c for c in changes if c[1] != c[2]]
+        if not changes:
+            return
+        self._undo.append(changes)
+        del self._undo[:-self.limit]
+        self._redo.clear()
+
+    def undo(self):
+        """Return the (key, position) assignments that revert the last edit, or None."""
+        if not self._undo:
+            return None
+        changes = self._undo.pop()
+        self._redo.append(changes)
+        return [(key, before) for key, before, _ in reversed(changes)]
+
+    def redo(self):
+        """Return the (key, position) assignments that re-apply the last undone edit, or None."""
+        if not self._redo:
+            return None
+        changes = self._redo.pop()
+        self._undo.append(changes)
+        return [(key, after) for key, _, after in changes]
+
+
+class ProxyPreview:
+    """Low-resolution render of the poster at display scale, using the generator's layout code.
+
+    The static layer (background + assets) is composed once. When positions change, only the
+    region covered by the old and new bounding boxes of the changed elements is re-rendered."""
+
+    def __init__(self, base_image, scale, lines, logo_file=gen.logo_path, logo_size=LOGO_SIZE):
+        self.base = base_image.convert('RGBA')
+        gen.place_assets(self.base, gen.list_asset_files())
+        self.scale = scale
+        self.lines = lines
+        self.logo_file = logo_file
+        self.logo_box = (max(1, int(logo_size[0] * scale)), max(1, int(logo_size[1] * scale)))
+        self.fonts = gen.load_fonts(scale)
+        self.elements = {}
+        self.image = None
+
+    def layout(self, positions):
+        """Return key -> list of (bbox, element) for positions, in display pixels."""
+        size = self.base.size
+        elements = {}
+        for run in gen.layout_text_blocks(size, self.lines, positions, self.fonts, scale=self.scale):
+            if run.text:
+                elements.setdefault(run.key, []).append((gen.text_run_bbox(run), run))
+        try:
+            entry = gen.LOGOS.get(self.logo_file, self.logo_box)
+        except OSError:
+            entry = None
+        if entry is not None:
+            logo_img, (ox, oy) = entry[0], entry[1]
+            bx, by = gen.logo_box_position(size, positions, self.logo_box,
+                                           gap=int(50 * self.scale), scale=self.scale)
+            x, y = bx + ox, by + oy
+            elements['logo'] = [((x, y, x + logo_img.width, y + logo_img.height), logo_img)]
+        return elements
+
+    def _draw(self, image, origin, region):
+        for items in self.elements.values():
+            for bbox, element in items:
+                if not intersects(bbox, region):
+                    continue
+                if isinstance(element, gen.TextRun):
+                    gen.draw_text_run(image, element, origin)
+                else:
+                    image.paste(element, (bbox[0] - origin[0], bbox[1] - origin[1]), element)
+
+    def render(self, positions):
+        """Render every element and return the full preview image."""
+        self.elements = self.layout(positions)
+        self.image = self.base.copy()
+        self._draw(self.image, (0, 0), (0, 0) + self.base.size)
+        return self.image
+
+    def update(self, positions):
+        """Re-render only what changed since the last render/update. Returns the dirty box or None."""
+        if self.image is None:
+            self.render(positions)
+            return (0, 0) + self.base.size
+        old, new = self.elements, self.layout(positions)
+        dirty = None
+        for key in set(old) | set(new):
+            if old.get(key) == new.get(key):
+                continue
+            for bbox, _ in old.get(key, []) + new.get(key, []):
+                dirty = bbox if dirty is None else (min(dirty[0], bbox[0]), min(dirty[1], bbox[1]),
+                                                    max(dirty[2], bbox[2]), max(dirty[3], bbox[3]))
+        self.elements = new
+        if dirty is None:
+            return None
+        w, h = self.base.size
+        dirty = (max(0, dirty[0]), max(0, dirty[1]), min(w, dirty[2]), min(h, dirty[3]))
+        if dirty[0] >= dirty[2] or dirty[1] >= dirty[3]:
+            return None
+        region = self.base.crop(dirty)
+        self._draw(region, dirty[:2], dirty)
+        self.image.paste(region, dirty[:2])
+        return dirty
+
+
+class PosterPlacer(tk.Tk):
+    def __init__(self, background_path=BACKGROUND, text_file=TEXT_FILE):
+        super().__init__()
+        self.title("Poster Placer")
+        self.geometry("1000x700")
+
+        self.background_path = background_path
+        self.text_file = text_file
+        self.lines = load_text_lines(self.text_file)
+        positions, self.logo_size = gen.load_positions(POSITIONS_FILE)
+        self.num_items = len(self.lines)
+        # index -> (x,y); saved positions are loaded so single markers can be dragged to fix them
+        self.positions = {k: tuple(v) for k, v in (positions or {}).items()}
+
+        self.canvas = tk.Canvas(self, bg="#ddd")
+        self.canvas.pack(fill=tk.BOTH, expand=True)
+
+        self.toolbar = tk.Frame(self)
+        self.toolbar.pack(fill=tk.X)
+
+        self.save_btn = tk.Button(self.toolbar, text="Save Positions", command=self.save_positions)
+        self.save_btn.pack(side=tk.LEFT)
+
+        self.load_bg_btn = tk.Button(self.toolbar, text="Load Background", command=self.load_background_dialog)
+        self.load_bg_btn.pack(side=tk.LEFT)
+
+        self.place_logo_btn = tk.Button(self.toolbar, text="Place Logo", command=self.enter_logo_mode)
+        self.place_logo_btn.pack(side=tk.LEFT)
+
+        self.clear_btn = tk.Button(self.toolbar, text="Clear Positions", command=self.clear_positions)
+        self.clear_btn.pack(side=tk.LEFT)
+
+        self.preview_var = tk.BooleanVar(value=True)
+        self.preview_chk = tk.Checkbutton(self.toolbar, text="Preview", variable=self.preview_var, command=self.toggle_preview)
+        self.preview_chk.pack(side=tk.LEFT)
+
+        self.instructions = tk.Label(self.toolbar, text=f"Click to place items 1..{self.num_items}. Current: 1")
+        self.instructions.pack(side=tk.LEFT, padx=10)
+
+        self.bind('<Configure>', self.on_resize)
+        self.canvas.bind('<ButtonPress-1>', self.on_press)
+        self.canvas.bind('<B1-Motion>', self.on_drag)
+        self.canvas.bind('<ButtonRelease-1>', self.on_release)
+        self.bind('<Control-z>', self.undo)
+        self.bind('<Control-y>', self.redo)
+        self.bind('<Control-Shift-Z>', self.redo)
+
+        self.bg_image = None
+        self.bg_tk = None
+        self.bg_photo_id = None
+        self.pyramid = None
+        self._pyramid_token = 0
+        self._refine_id = None
+        self._last_view = None
+        self.preview = None
+
+        # Canvas items are created once and then moved or reconfigured in place
+        self.markers = {}  # key -> (oval id, label id)
+        self.hit_grid = SpatialGrid()
+        self.history = History()
+        self._ruler_view = None
+        self._drag = None
+        self.scale = 1.0
+        self.offset_x = self.offset_y = 0
+        self.display_w = self.display_h = 0
+
+        self.current_index = self.next_index()
+        self.logo_mode = False
+
+        self.load_background(self.background_path)
+        self.draw_rulers()
+        self.redraw()
+
+    def load_background_dialog(self):
+        fp = filedialog.askopenfilename(title="Select background image", filetypes=[("Image files", "*.png;*.jpg;*.jpeg;*.bmp")])
+        if fp:
+            self.background_path = fp
+            self.load_background(fp)
+            self.redraw()
+
+    def load_background(self, path):
+        if not os.path.exists(path):
+            # create placeholder background
+            self.bg_image = Image.new('RGBA', (1200, 800), (255, 255, 255, 255))
+        else:
+            self.bg_image = Image.open(path).convert('RGBA')
+        self.pyramid = None
+        self._last_view = None
+        self._build_pyramid_async(self.bg_image)
+
+    def _build_pyramid_async(self, image):
+        # Build the mipmaps off the UI thread; Tk calls stay on the main thread
+        self._pyramid_token += 1
+        token = self._pyramid_token
+        result = {}
+
+        def work():
+            result['levels'] = build_pyramid(image)
+
+        worker = threading.Thread(target=work, daemon=True)
+        worker.start()
+
+        def poll():
+            if token != self._pyramid_token:
+                return  # a newer background replaced this one
+            if worker.is_alive():
+                self.after(50, poll)
+                return
+            self.pyramid = result.get('levels')
+            self._last_view = None
+            self.redraw()
+
+        self.after(50, poll)
+
+    def toggle_preview(self):
+        self._last_view = None
+        self.redraw()
+
+    def update_preview(self):
+        # Re-render only the region touched by the element that moved, and upload only that region
+        if self.preview is None:
+            return
+        dirty = self.preview.update(self.positions)
+        if dirty is None:
+            return
+        patch = ImageTk.PhotoImage(self.preview.image.crop(dirty))
+        self.tk.call(str(self.bg_tk), 'copy', str(patch), '-to', dirty[0], dirty[1], '-compositingrule', 'set')
+
+    def draw_rulers(self):
+        # Rulers are drawn on canvas on redraw
+        pass
+
+    def on_resize(self, event):
+        # Draw a fast preview now and one full-quality redraw once resizing settles
+        if self._refine_id is not None:
+            self.after_cancel(self._refine_id)
+        self._refine_id = self.after(RESIZE_DEBOUNCE_MS, self._refine)
+        self.redraw(fast=True)
+
+    def _refine(self):
+        self._refine_id = None
+        self.redraw()
+
+    def redraw(self, fast=False):
+        # Draw background centered or fitted
+        w = self.canvas.winfo_width()
+        h = self.canvas.winfo_height()
+        if w <= 1 or h <= 1:
+            self.after(50, self.redraw)
+            return
+
+        # fit bg_image to canvas while preserving aspect
+        bg_w, bg_h = self.bg_image.size
+        scale = min(w / bg_w, h / bg_h)
+        new_w = max(1, int(bg_w * scale))
+        new_h = max(1, int(bg_h * scale))
+        view = (w, h, new_w, new_h)
+        if self._last_view is not None and self._last_view[:4] == view and (fast or not self._last_view[4]):
+            # same size and at least the requested quality: nothing on the canvas changes
+            return
+        self._last_view = view + (fast,)
+
+        # Resample from the nearest pyramid level instead of the full-size image
+        source = pick_level(self.pyramid, new_w, new_h) if self.pyramid else self.bg_image
+        resample = Image.BILINEAR if fast else Image.LANCZOS
+        if fast and source is self.bg_image:
+            resample = Image.NEAREST
+        resized = source.resize((new_w, new_h), resample)
+        self.preview = None
+        if self.preview_var.get() and not fast:
+            # Proxy render of the real poster; skipped while resizing to keep the drag smooth
+            self.preview = ProxyPreview(resized, new_w / bg_w, self.lines, logo_size=self.logo_size)
+            resized = self.preview.render(self.positions)
+        self.bg_tk = ImageTk.PhotoImage(resized)
+        if self.bg_photo_id is None:
+            self.bg_photo_id = self.canvas.create_image((w//2, h//2), image=self.bg_tk)
+        else:
+            self.canvas.itemconfigure(self.bg_photo_id, image=self.bg_tk)
+            self.canvas.coords(self.bg_photo_id, w//2, h//2)
+
+        # Store transform for converting clicks
+        self.offset_x = (w - new_w) // 2
+        self.offset_y = (h - new_h) // 2
+        self.display_w = new_w
+        self.display_h = new_h
+
+        self.redraw_overlays(scale)
+
+    def redraw_overlays(self, scale):
+        # The view changed: move every marker and rebuild the rulers only if their extent changed
+        self.scale = scale
+        ruler_view = (self.offset_x, self.offset_y, self.display_w, self.display_h)
+        if ruler_view != self._ruler_view:
+            self._ruler_view = ruler_view
+            self.canvas.delete('ruler')
+            self.draw_rulers_lines()
+        for key in list(self.markers):
+            if key not in self.positions:
+                self.remove_marker(key)
+        for key in self.positions:
+            self.place_marker(key)
+        self.update_instructions()
+
+    def update_instructions(self):
+        if self.current_index <= self.num_items:
+            text = f"Click to place items 1..{self.num_items}. Current: {self.current_index}"
+        else:
+            text = "All items placed"
+        self.instructions.config(text=text + ". Drag markers to move; Ctrl+Z / Ctrl+Y to undo / redo")
+
+    def draw_rulers_lines(self):
+        # horizontal ruler
+        for i in range(0, self.display_w, 50):
+            x = self.offset_x + i
+            self.canvas.create_line(x, self.offset_y, x, self.offset_y + 10, fill='#222', tags=('overlay', 'ruler'))
+            if i % 100 == 0:
+                self.canvas.create_text(x+2, self.offset_y+20, text=str(i), anchor='n', font=('Arial', 8),
+                                        tags=('overlay', 'ruler'))
+        # vertical ruler
+        for j in range(0, self.display_h, 50):
+            y = self.offset_y + j
+            self.canvas.create_line(self.offset_x, y, self.offset_x + 10, y, fill='#222', tags=('overlay', 'ruler'))
+            if j % 100 == 0:
+                self.canvas.create_text(self.offset_x+20, y+2, text=str(j), anchor='w', font=('Arial', 8),
+                                        tags=('overlay', 'ruler'))
+
+    def to_display(self, pos):
+        x, y = pos
+        return int(x * self.scale) + self.offset_x, int(y * self.scale) + self.offset_y
+
+    def to_background(self, x, y):
+        # clamp into the background so a drag cannot leave it
+        x = min(max(x, self.offset_x), self.offset_x + self.display_w)
+        y = min(max(y, self.offset_y), self.offset_y + self.display_h)
+        return int((x - self.offset_x) / self.scale), int((y - self.offset_y) / self.scale)
+
+    def place_marker(self, key):
+        """Create key's marker or move the existing one to its stored position."""
+        x, y = self.to_display(self.positions[key])
+        r = MARKER_RADIUS
+        items = self.markers.get(key)
+        if items is None:
+            # 'logo' (or another named key) gets a short label
+            display = 'L' if str(key).lower() == 'logo' else str(key)
+            oval = self.canvas.create_oval(x-r, y-r, x+r, y+r, fill='red', tags=('overlay', 'marker'))
+            label = self.canvas.create_text(x+12, y, text=display, anchor='w', font=('Arial', 12), fill='black',
+                                            tags=('overlay', 'marker'))
+            self.markers[key] = (oval, label)
+        else:
+            oval, label = items
+            self.canvas.coords(oval, x-r, y-r, x+r, y+r)
+            self.canvas.coords(label, x+12, y)
+        # a little slack around the dot makes markers easier to grab
+        self.hit_grid.insert(key, (x-r-3, y-r-3, x+r+3, y+r+3))
+
+    def remove_marker(self, key):
+        for item in self.markers.pop(key, ()):
+            self.canvas.delete(item)
+        self.hit_grid.remove(key)
+
+    def next_index(self):
+        """The first numbered item without a position (num_items + 1 when all are placed)."""
+        for i in range(1, self.num_items + 1):
+            if str(i) not in self.positions:
+                return i
+        return self.num_items + 1
+
+    def apply_positions(self, assignments):
+        """Set (key, position) pairs, None removing a position, and update only their markers."""
+        for key, pos in assignments:
+            if pos is None:
+                self.positions.pop(key, None)
+                self.remove_marker(key)
+            else:
+                self.positions[key] = tuple(pos)
+                self.place_marker(key)
+        self.current_index = self.next_index()
+        self.update_preview()
+        self.update_instructions()
+
+    def edit_positions(self, assignments):
+        """apply_positions() as one undoable edit."""
+        self.history.record([(key, self.positions.get(key), None if pos is None else tuple(pos))
+                             for key, pos in assignments])
+        self.apply_positions(assignments)
+
+    def undo(self, event=None):
+        assignments = self.history.undo()
+        if assignments:
+            self.apply_positions(assignments)
+
+    def redo(self, event=None):
+        assignments = self.history.redo()
+        if assignments:
+            self.apply_positions(assignments)
+
+    def on_press(self, event):
+        key = None if self.logo_mode else self.hit_grid.hit(event.x, event.y)
+        self._drag = {'key': key, 'start': self.positions[key], 'moved': False} if key is not None else None
+
+    def on_drag(self, event):
+        if self._drag is None:
+            return
+        # Only the dragged marker's two canvas items and grid cells are touched
+        key = self._drag['key']
+        self.positions[key] = self.to_background(event.x, event.y)
+        self.place_marker(key)
+        self._drag['moved'] = True
+
+    def on_release(self, event):
+        drag, self._drag = self._drag, None
+        if drag is None:
+            self.on_click(event)
+        elif drag['moved']:
+            key = drag['key']
+            self.history.record([(key, drag['start'], self.positions[key])])
+            self.update_preview()
+
+    def on_click(self, event):
+        # If click outside bg area, ignore
+        if event.x < self.offset_x or event.x > self.offset_x + self.display_w:
+            return
+        if event.y < self.offset_y or event.y > self.offset_y + self.display_h:
+            return
+
+        # convert display coords to bg image coords
+        scale = self.display_w / self.bg_image.size[0]
+        bg_x = int((event.x - self.offset_x) / scale)
+        bg_y = int((event.y - self.offset_y) / scale)
+
+        # If in logo placement mode, save under 'logo' key and exit logo mode
+        if self.logo_mode:
+            self.logo_mode = False
+            self.edit_positions([('logo', (bg_x, bg_y))])
+            messagebox.showinfo("Logo placed", "Logo position saved.")
+            return
+
+        # Save position for current index (numeric items)
+        if self.current_index <= self.num_items:
+            self.edit_positions([(str(self.current_index), (bg_x, bg_y))])
+            if self.current_index > self.num_items:
+                messagebox.showinfo("Done", "All items placed. Positions will be auto-saved.")
+                # auto-save when complete
+                try:
+                    self.save_positions()
+                except Exception as e:
+                    messagebox.showerror('Save Error', f'Could not auto-save positions: {e}')
+        else:
+            messagebox.showinfo("Info", "All items already placed")
+
+    def enter_logo_mode(self):
+        self.logo_mode = True
+        self.instructions.config(text="Click on the background to place the logo (will be saved under key 'logo')")
+
+    def save_positions(self):
+        # Keep keys the placer does not edit (e.g. 'derivatives')
+        data = {}
+        try:
+            with open(POSITIONS_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            pass
+        data.update({
+            'background': self.background_path,
+            'lines': self.lines,
+            'positions': self.positions,
+            'logo_size': list(self.logo_size)
+        })
+        with open(POSITIONS_FILE, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        messagebox.showinfo('Saved', f'Positions saved to {POSITIONS_FILE}')
+
+    def clear_positions(self):
+        # one undoable edit, so an accidental clear can be reverted with Ctrl+Z
+        self.edit_positions([(key, None) for key in list(self.positions)])
+
+
+if __name__ == '__main__':
+    app = PosterPlacer()
+    app.mainloop()
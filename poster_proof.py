@@ -0,0 +1,140 @@
+# Proof export for batches: contact sheets or a multi-page PDF, built while the batch renders.
+#
+# Workers cut a small proxy from each poster while it is still in memory (never from the
+# saved file) and send it to the parent with the render result. The parent lays proxies out
+# in job order on the current page and writes the page as soon as it is full: PDF pages are
+# appended to one file (Pillow's incremental append), other formats become numbered contact
+# sheet images. Only one page and the proxies of jobs still rendering are ever held, however
+# large the batch.
+import os
+import textwrap
+
+from PIL import Image, ImageDraw, ImageFont
+
+from poster_derivatives import downscale
+from poster_output import format_for_path, save_image
+
+# Proxies fit in a square of this many pixels
+PROXY_SIZE = 360
+COLUMNS = 4
+ROWS = 5
+MARGIN = 24
+LABEL_HEIGHT = 28
+LABEL_FONT_SIZE = 14
+PAGE_COLOR = (255, 255, 255)
+LABEL_COLOR = (40, 40, 40)
+NOTE_COLOR = (200, 30, 30)
+PDF_RESOLUTION = 150
+
+
+def proxy_size(size, box=PROXY_SIZE):
+    """Size of a proxy for an image of size: the largest that fits a box x box square."""
+    scale = min(box / size[0], box / size[1], 1.0)
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def make_proxy(image, box=PROXY_SIZE):
+    """Return a reduced RGB copy of image that fits a box x box square."""
+    proxy = downscale(image, (0, 0) + image.size, proxy_size(image.size, box))
+    return proxy if proxy.mode == 'RGB' else proxy.convert('RGB')
+
+
+class StripProxy:
+    """Builds a proxy from the strips of a strip render as they go by (see poster_tiles)."""
+
+    def __init__(self, size, box=PROXY_SIZE):
+        self.size = size
+        self.image = Image.new('RGB', proxy_size(size, box), PAGE_COLOR)
+        self.scale = self.image.height / size[1]
+
+    def add(self, y, strip):
+        top, bottom = round(y * self.scale), round((y + strip.height) * self.scale)
+        if bottom > top:
+            self.image.paste(downscale(strip, (0, 0) + strip.size, (self.image.width, bottom - top)), (0, top))
+
+
+class ProofWriter:
+    """Lays proxies out COLUMNS x ROWS per page and writes each page once it is full.
+
+    Entries are added with their job's sequence number and placed in that order; an entry
+    waits only until the entries before it have arrived. path ending in .pdf gives one
+    multi-page PDF, any other image extension gives path_001.ext, path_002.ext, ..."""
+
+    def __init__(self, path, columns=COLUMNS, rows=ROWS, box=PROXY_SIZE):
+        self.path = path
+        self.format = 'PDF' if path.lower().endswith('.pdf') else format_for_path(path)
+        self.columns, self.rows, self.box = columns, rows, box
+        self.cell = (box + MARGIN, box + LABEL_HEIGHT + MARGIN)
+        self.page_size = (columns * self.cell[0] + MARGIN, rows * self.cell[1] + MARGIN)
+        try:
+            self.font = ImageFont.load_default(LABEL_FONT_SIZE)
+        except TypeError:
+            # Pillow before 10.1 has no sized default font; use the small bitmap one
+            self.font = ImageFont.load_default()
+        self.page = None
+        self.slot = 0
+        self.pages = 0
+        self.entries = 0
+        self.next_seq = 0
+        # entries that arrived ahead of an earlier job: seq -> (label, image, note)
+        self.waiting = {}
+        if self.format == 'PDF' and os.path.exists(path):
+            os.remove(path)
+
+    def add(self, seq, label, image=None, note=None):
+        """Place the proxy image (or a note, for jobs without one) for job number seq."""
+        self.waiting[seq] = (label, image, note)
+        self._place_ready()
+
+    def skip(self, seq):
+        """Leave job number seq out of the proof (e.g. it was already up to date)."""
+        self.waiting[seq] = None
+        self._place_ready()
+
+    def _place_ready(self):
+        while self.next_seq in self.waiting:
+            entry = self.waiting.pop(self.next_seq)
+            self.next_seq += 1
+            if entry is not None:
+                self._place(*entry)
+
+    def _place(self, label, image, note):
+        if self.page is None:
+            self.page = Image.new('RGB', self.page_size, PAGE_COLOR)
+        draw = ImageDraw.Draw(self.page)
+        col, row = self.slot % self.columns, self.slot // self.columns
+        x, y = MARGIN + col * self.cell[0], MARGIN + row * self.cell[1]
+        if image is not None:
+            # centered in the cell's square
+            self.page.paste(image, (x + (self.box - image.width) // 2, y + (self.box - image.height) // 2))
+        else:
+            draw.rectangle((x, y, x + self.box - 1, y + self.box - 1), outline=NOTE_COLOR)
+        draw.text((x, y + self.box + 4), label, font=self.font, fill=LABEL_COLOR)
+        if note:
+            # roughly as many characters as fit the cell
+            draw.multiline_text((x + 8, y + 8), textwrap.fill(note, self.box * 2 // LABEL_FONT_SIZE - 2),
+                                font=self.font, fill=NOTE_COLOR)
+        self.entries += 1
+        self.slot += 1
+        if self.slot == self.columns * self.rows:
+            self._flush()
+
+    def _flush(self):
+        if self.page is None:
+            return
+        self.pages += 1
+        if self.format == 'PDF':
+            self.page.save(self.path, 'PDF', resolution=PDF_RESOLUTION, append=self.pages > 1)
+        else:
+            stem, ext = os.path.splitext(self.path)
+            save_image(self.page, f"{stem}_{self.pages:03d}{ext}", self.format)
+        self.page = None
+        self.slot = 0
+
+    def close(self):
+        """Place whatever is still waiting, in order, and write the last page."""
+        for seq in sorted(self.waiting):
+            entry = self.waiting.pop(seq)
+            if entry is not None:
+                self._place(*entry)
+        self._flush()
@@ -0,0 +1,535 @@
+# Memory-aware batch scheduler.
+#
+# Jobs are resolved in the parent and streamed through a bounded lookahead window. Each job
+# gets an estimate of the memory it will hold while it renders, computed from the canvas
+# size (read from the image header or bundle) and the asset and derivative sizes. Jobs are
+# admitted in order while the in-flight estimates, plus the base layers each worker is known
+# to cache, stay within the memory budget; one job is always admitted so the batch cannot
+# stall on a job larger than the budget.
+#
+# Every worker is its own process with its own inbox, so a job can be routed to the worker
+# that already caches its base layer (its "template") instead of whichever is free first.
+# Jobs whose resolved inputs hash to the same key (see job_input_key) are folded: the first
+# one renders and the others get copies of its files.
+#
+# With a proof (see poster_proof), workers also send a small proxy of every poster they
+# render, and the parent adds it to the proof once the job's files are written.
+import os
+import queue
+import shutil
+import time
+import multiprocessing
+from collections import OrderedDict, deque
+
+import poster_generator as gen
+from poster_cache import DEFAULT_MAX_BYTES, base_layer_key
+from poster_derivatives import derivative_path
+from poster_tiles import strip_bundle_path
+from poster_output import OutputStage
+from poster_trace import TRACER, stage
+
+# Jobs queued on one worker at a time: one rendering while the previous one is encoded
+WORKER_DEPTH = 2
+# Resolved jobs kept waiting per worker, for routing jobs to the worker holding their template
+LOOKAHEAD_PER_WORKER = 4
+# How often the parent checks for dead workers while waiting for messages, in seconds
+POLL_INTERVAL = 0.5
+# Base layers, frames and derivatives are RGB; overlays are RGBA
+RGB_BYTES = 3
+RGBA_BYTES = 4
+
+
+def physical_memory():
+    """Total physical memory in bytes, or None where the platform does not report it."""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_memory_budget():
+    """Half of physical memory, or None (unlimited) when it is unknown."""
+    total = physical_memory()
+    return total // 2 if total else None
+
+
+def template_key(job):
+    """Key of the base layer a resolved job renders on; equal to the worker cache's key.
+
+    Strip jobs without a bundle are keyed by the bundle compiled for them, so jobs sharing one
+    go to the same worker and it is compiled once. Animated jobs build their own base layer
+    outside the cache (see poster_animate) and have no key."""
+    if gen.is_animated_job(job):
+        return None
+    if job['strip_height'] and not job.get('bundle'):
+        return 'strip:' + strip_bundle_path(job)
+    source_key = gen.load_bundle(job['bundle']).key if job.get('bundle') else None
+    return base_layer_key(job['background'], job['logo'], gen.list_asset_files(job['assets_dir']),
+                          job['logo_size'], gen.logo_coordinate(job['positions']), source_key=source_key)
+
+
+def estimate_job_bytes(job, template_warm=False, canvas=None):
+    """Estimate the peak memory a worker holds for a resolved job, in bytes.
+
+    Counts the poster frame and its derivatives (kept until encoded), the asset thumbnails
+    and, unless the worker already caches the template, the decoded background and the base
+    layer built from it. Strip rendering only ever holds a few strips, but compiling the
+    bundle it reads from decodes the whole background. Animated jobs never find their template
+    cached. canvas is the background size when already known."""
+    width, height = canvas or gen.canvas_size(job)
+    frame = width * height * RGB_BYTES
+    assets = len(gen.list_asset_files(job['assets_dir']))
+    # thumbnails fit in 40% x 40% of the canvas each (see asset_layout)
+    thumbnails = int(assets * width * 0.4 * height * 0.4) * RGBA_BYTES
+    if job['strip_height']:
+        strip = width * int(job['strip_height']) * RGB_BYTES
+        # the strip being composed, the shifted copy the PNG filter needs and the filtered rows
+        total = 4 * strip + thumbnails
+        if not template_warm and not job.get('bundle') and not os.path.exists(strip_bundle_path(job)):
+            # the first use compiles a bundle from the decoded background (at most 4 bytes a pixel)
+            total += width * height * RGBA_BYTES
+        return total
+    if gen.is_animated_job(job):
+        # the base layer without the animated assets, the still frame with the text and the
+        # first frame; a GIF also quantizes that frame to one byte a pixel
+        total = 3 * frame + thumbnails
+        if job['format'] == 'GIF':
+            total += width * height
+        return total
+    derivatives = sum(w * h * RGB_BYTES for _, (w, h), _, _ in job['derivatives'])
+    total = frame + derivatives + thumbnails
+    if not template_warm:
+        # the decoded background and the base layer composed from it
+        total += 2 * frame
+    return total
+
+
+def _worker_main(worker_id, inbox, outbox, cache_bytes, encode_threads, profile, proxy_box=None):
+    gen._init_worker(cache_bytes, profile)
+    if proxy_box:
+        from poster_proof import StripProxy, make_proxy
+
+    def written(tag, res):
+        task_id, index, render_seconds = tag
+        outbox.put(('written', task_id, index, render_seconds, res))
+
+    def error(tag, path, message):
+        outbox.put(('error', tag[0], path, message))
+
+    out_stage = OutputStage(workers=encode_threads, max_pending=encode_threads,
+                            on_result=written, on_error=error)
+    while True:
+        item = inbox.get()
+        if item is None:
+            break
+        task_id, spec = item
+        start = time.perf_counter()
+        try:
+            with stage('render', output=spec.get('output')):
+                with stage('resolve'):
+                    job = gen.resolve_spec(spec)
+                if job['strip_height']:
+                    # strips are encoded as they are rendered
+                    proxy = StripProxy(gen.canvas_size(job), proxy_box) if proxy_box else None
+                    res = gen.render_striped(job, on_strip=proxy.add if proxy else None)
+                    if proxy:
+                        outbox.put(('proxy', task_id, proxy.image))
+                    outbox.put(('rendered', task_id, 1))
+                    written((task_id, 0, time.perf_counter() - start), res)
+                    outputs = None
+                elif gen.is_animated_job(job):
+                    def send_proxy(image):
+                        outbox.put(('proxy', task_id, make_proxy(image, proxy_box)))
+                    res = gen.render_animated(job, on_first_frame=send_proxy if proxy_box else None)
+                    outbox.put(('rendered', task_id, 1))
+                    written((task_id, 0, time.perf_counter() - start), res)
+                    outputs = None
+                else:
+                    outputs = gen.render_outputs(job)
+        except Exception as e:
+            outbox.put(('failed', task_id, f"{type(e).__name__}: {e}"))
+            continue
+        if outputs is not None:
+            render_seconds = time.perf_counter() - start
+            if proxy_box:
+                with stage('proxy'):
+                    outbox.put(('proxy', task_id, make_proxy(outputs[0][0], proxy_box)))
+            outbox.put(('rendered', task_id, len(outputs)))
+            for i, (image, path) in enumerate(outputs):
+                out_stage.submit(image, path, job['format'], job['encoder'], tag=(task_id, i, render_seconds))
+            del outputs, image
+        if TRACER.enabled:
+            outbox.put(('trace', TRACER.drain()))
+    out_stage.join()
+    out_stage.close()
+    outbox.put(('exit', worker_id, TRACER.drain()))
+
+
+class _Worker:
+    def __init__(self, worker_id, outbox, cache_bytes, encode_threads, profile, proxy_box=None):
+        self.id = worker_id
+        self.cache_bytes = cache_bytes
+        self.inbox = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=_worker_main,
+            args=(worker_id, self.inbox, outbox, cache_bytes, encode_threads, profile, proxy_box),
+            daemon=True)
+        self.process.start()
+        self.tasks = set()
+        # model of the worker's base layer LRU: template key -> bytes, oldest first
+        self.templates = OrderedDict()
+        self.exited = False
+
+    def holds(self, key):
+        return key is not None and key in self.templates
+
+    def touch(self, key, size):
+        """Record that the worker now caches the template key, evicting like BaseLayerCache."""
+        if key is None:
+            return
+        if key in self.templates:
+            self.templates.move_to_end(key)
+            return
+        if size > self.cache_bytes:
+            return
+        self.templates[key] = size
+        while sum(self.templates.values()) > self.cache_bytes:
+            self.templates.popitem(last=False)
+
+    def template_bytes(self):
+        return sum(self.templates.values())
+
+
+class _Task:
+    def __init__(self, task_id, seq, spec, job, key, template):
+        self.id = task_id
+        self.seq = seq
+        self.spec = spec
+        self.job = job
+        self.key = key
+        self.template = template
+        canvas = gen.canvas_size(job)
+        # strip rendering reads the mapped bundle and animated jobs build their own layers; neither
+        # caches a base layer
+        self.template_size = 0 if job['strip_height'] or template is None else canvas[0] * canvas[1] * RGB_BYTES
+        # estimated bytes on a worker without and with the template cached
+        self.cold = estimate_job_bytes(job, False, canvas)
+        self.warm = estimate_job_bytes(job, True, canvas)
+        self.estimate = 0
+        self.worker = None
+        self.skipped = 0
+        # duplicate jobs folded into this one, as (seq, resolved job)
+        self.copies = []
+        self.proxy = None
+        self.expected = None
+        self.results = []
+        self.errors = []
+
+    @property
+    def done(self):
+        return self.expected is not None and len(self.results) + len(self.errors) >= self.expected
+
+
+def output_paths(job):
+    """The poster path followed by each derivative path of a resolved job."""
+    return [job['output']] + [derivative_path(job['output'], d[0]) for d in job['derivatives']]
+
+
+class BatchScheduler:
+    """Renders a stream of job specs on worker processes; see the module comment."""
+
+    def __init__(self, workers=None, cache_bytes=DEFAULT_MAX_BYTES, memory_budget=None,
+                 manifest=None, encode_threads=2, proof=None):
+        self.workers_wanted = workers or os.cpu_count() or 1
+        self.lookahead = self.workers_wanted * LOOKAHEAD_PER_WORKER
+        self.cache_bytes = cache_bytes
+        self.memory_budget = memory_budget
+        self.manifest = manifest
+        self.encode_threads = encode_threads
+        self.proof = proof
+        self.outbox = multiprocessing.Queue()
+        self.workers = []
+        self.window = deque()
+        self.tasks = {}
+        # input key -> task still rendering, or the resolved job whose files are already written
+        self.pending_keys = {}
+        self.finished_keys = {}
+        self.next_id = 0
+        # position of the next spec in the jobs file, which orders the proof
+        self.next_seq = 0
+        self.rendered = self.failed = self.skipped = self.folded = 0
+        self.bytes_written = 0
+
+    # -- workers -------------------------------------------------------------
+
+    def _spawn(self):
+        worker_id = len(self.workers)
+        self.workers.append(_Worker(worker_id, self.outbox, self.cache_bytes, self.encode_threads,
+                                    TRACER.enabled, self.proof.box if self.proof else None))
+
+    def _live_workers(self):
+        return [w for w in self.workers if not w.exited]
+
+    def _check_workers(self):
+        # A worker killed mid-job (e.g. by the OOM killer) never reports; fail its jobs and replace it
+        for w in self._live_workers():
+            if w.process.is_alive():
+                continue
+            w.exited = True
+            for task_id in list(w.tasks):
+                task = self.tasks[task_id]
+                self._fail(task, f"worker exited with code {w.process.exitcode}")
+            w.tasks.clear()
+            self._spawn()
+
+    # -- admission -----------------------------------------------------------
+
+    def in_use(self):
+        """Estimated bytes held by in-flight jobs and the templates cached by the workers."""
+        return (sum(self.tasks[t].estimate for w in self.workers for t in w.tasks)
+                + sum(w.template_bytes() for w in self._live_workers()))
+
+    def _fits(self, task, worker):
+        warm = worker.holds(task.template)
+        task.estimate = task.warm if warm else task.cold
+        if self.memory_budget is None or not any(w.tasks for w in self.workers):
+            return True
+        # a template the worker does not cache yet will stay resident after the job
+        extra = 0 if warm or task.template_size > self.cache_bytes else task.template_size
+        return self.in_use() + task.estimate + extra <= self.memory_budget
+
+    def _pick(self, free):
+        """Choose the next (task, worker) pair among the waiting jobs and free workers."""
+        head = self.window[0]
+        # a job passed over this often goes next, wherever its template is
+        if head.skipped < self.lookahead:
+            for task in self.window:
+                for w in free:
+                    if w.holds(task.template):
+                        return task, w
+        # otherwise the oldest job, on a worker that holds no template it would evict
+        worker = min(free, key=lambda w: (len(w.tasks), w.template_bytes()))
+        return head, worker
+
+    def _dispatch(self):
+        while self.window:
+            free = [w for w in self._live_workers() if len(w.tasks) < WORKER_DEPTH]
+            if not free:
+                return
+            task, worker = self._pick(free)
+            if not self._fits(task, worker):
+                return
+            for other in self.window:
+                if other is task:
+                    break
+                other.skipped += 1
+            self.window.remove(task)
+            task.worker = worker
+            worker.tasks.add(task.id)
+            worker.touch(task.template, task.template_size)
+            worker.inbox.put((task.id, task.spec))
+
+    # -- jobs ----------------------------------------------------------------
+
+    def _add(self, spec):
+        """Resolve a spec and queue it, fold it into an identical job, or skip it. Returns False on failure."""
+        seq = self.next_seq
+        self.next_seq += 1
+        try:
+            job = gen.resolve_spec(spec)
+            key = gen.job_input_key(job)
+            if self.manifest is not None and gen.is_up_to_date(self.manifest, job, key):
+                self.skipped += 1
+                if self.proof:
+                    self.proof.skip(seq)
+                return True
+            if key in self.pending_keys:
+                self.pending_keys[key].copies.append((seq, job))
+                return True
+            if key in self.finished_keys:
+                source = self.finished_keys[key]
+                error = self._copy_outputs(source, job, key)
+                self._add_proof(seq, job['output'], note=error or f"same job as {os.path.basename(source['output'])}")
+                return True
+            task = _Task(self.next_id, seq, spec, job, key, template_key(job))
+        except Exception as e:
+            self.failed += 1
+            error = f"{type(e).__name__}: {e}"
+            print(f"❌ {spec.get('output')}: {error}")
+            self._add_proof(seq, spec.get('output'), note=error)
+            return False
+        self.next_id += 1
+        self.tasks[task.id] = task
+        self.pending_keys[key] = task
+        self.window.append(task)
+        return True
+
+    def _copy_outputs(self, source, job, key):
+        # Fan a finished render out to a folded duplicate's paths
+        try:
+            for src, dst in zip(output_paths(source), output_paths(job)):
+                if os.path.abspath(src) == os.path.abspath(dst):
+                    continue
+                out_dir = os.path.dirname(dst)
+                if out_dir:
+                    os.makedirs(out_dir, exist_ok=True)
+                shutil.copyfile(src, dst)
+        except OSError as e:
+            self.failed += 1
+            error = f"{type(e).__name__}: {e}"
+            print(f"❌ {job['output']}: {error}")
+            return error
+        self.rendered += 1
+        self.folded += 1
+        size = os.path.getsize(job['output'])
+        self.bytes_written += size
+        if self.manifest is not None:
+            self.manifest.record(job['output'], key)
+        print(f"✅ Poster saved as {job['output']} (same job as {source['output']}, {size / 1024:.0f} KB)")
+        return None
+
+    def _add_proof(self, seq, output, image=None, note=None):
+        if self.proof:
+            self.proof.add(seq, os.path.basename(output or ''), image, note)
+
+    def _finish(self, task):
+        if task.worker is not None:
+            task.worker.tasks.discard(task.id)
+        del self.tasks[task.id]
+        del self.pending_keys[task.key]
+        if task.errors:
+            error = task.errors[0][1]
+            self._add_proof(task.seq, task.job['output'], task.proxy, error)
+            self.failed += len(task.copies)
+            for seq, job in task.copies:
+                print(f"❌ {job['output']}: same job as {task.job['output']}, which failed")
+                self._add_proof(seq, job['output'], task.proxy, error)
+            return
+        if self.manifest is not None:
+            self.manifest.record(task.job['output'], task.key)
+        self.finished_keys[task.key] = task.job
+        self._add_proof(task.seq, task.job['output'], task.proxy)
+        for seq, job in task.copies:
+            error = self._copy_outputs(task.job, job, task.key)
+            self._add_proof(seq, job['output'], None if error else task.proxy, error)
+
+    def _fail(self, task, error):
+        task.errors.append((task.spec.get('output'), error))
+        self.failed += 1
+        print(f"❌ {task.spec.get('output')}: {error}")
+        self._finish(task)
+
+    def _handle(self, message):
+        kind = message[0]
+        if kind == 'trace':
+            TRACER.extend(message[1])
+            return
+        if kind == 'exit':
+            _, worker_id, events = message
+            self.workers[worker_id].exited = True
+            TRACER.extend(events)
+            return
+        task = self.tasks.get(message[1])
+        if task is None:
+            # the task was already failed by _check_workers
+            return
+        if kind == 'failed':
+            self._fail(task, message[2])
+            return
+        if kind == 'proxy':
+            task.proxy = message[2]
+            return
+        if kind == 'rendered':
+            task.expected = message[2]
+        elif kind == 'written':
+            _, _, index, render_seconds, res = message
+            task.results.append(res)
+            self.bytes_written += res.bytes_written
+            if index == 0:
+                self.rendered += 1
+                print(f"✅ Poster saved as {res.path} (render {render_seconds:.2f}s, "
+                      f"encode {res.encode_seconds:.2f}s, {res.bytes_written / 1024:.0f} KB)")
+            else:
+                print(f"   ↳ {res.path} ({res.bytes_written / 1024:.0f} KB)")
+        elif kind == 'error':
+            _, _, path, error = message
+            task.errors.append((path, error))
+            self.failed += 1
+            print(f"❌ {path}: {error}")
+        if task.done:
+            self._finish(task)
+
+    def _receive(self):
+        try:
+            self._handle(self.outbox.get(timeout=POLL_INTERVAL))
+        except queue.Empty:
+            pass
+        self._check_workers()
+
+    def run(self, specs):
+        """Render every spec. Returns (rendered, failed) counts."""
+        for _ in range(self.workers_wanted):
+            self._spawn()
+        specs = iter(specs)
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(self.window) < self.lookahead:
+                    spec = next(specs, None)
+                    if spec is None:
+                        exhausted = True
+                    else:
+                        self._add(spec)
+                self._dispatch()
+                if exhausted and not self.tasks:
+                    break
+                self._receive()
+        finally:
+            self._shutdown()
+        return self.rendered, self.failed
+
+    def _shutdown(self):
+        for w in self._live_workers():
+            w.inbox.put(None)
+        # wait for every worker to flush its encoder threads and send its trace events
+        while any(not w.exited and w.process.is_alive() for w in self.workers):
+            try:
+                self._handle(self.outbox.get(timeout=POLL_INTERVAL))
+            except queue.Empty:
+                pass
+        for w in self.workers:
+            w.process.join()
+
+
+def run_batch(jobs_file, workers=None, output_dir=None, cache_bytes=DEFAULT_MAX_BYTES,
+              defaults=None, manifest=None, memory_budget=None, proof=None):
+    """Render every job in jobs_file with a BatchScheduler. Returns (rendered, failed) counts.
+
+    proof is a path for a proof of the rendered posters (see poster_proof.ProofWriter)."""
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    gen.load_fonts()
+    for warning in gen.font_warnings():
+        print(warning)
+    start = time.perf_counter()
+    writer = None
+    if proof:
+        from poster_proof import ProofWriter
+        writer = ProofWriter(proof)
+    scheduler = BatchScheduler(workers, cache_bytes, memory_budget, manifest, proof=writer)
+    rendered, failed = scheduler.run(gen.iter_jobs(jobs_file, output_dir, defaults))
+    if manifest is not None:
+        manifest.save()
+    if writer:
+        writer.close()
+        print(f"📄 Proof of {writer.entries} poster(s) on {writer.pages} page(s) written to {proof}")
+    total = time.perf_counter() - start
+    extra = ''
+    if scheduler.folded:
+        extra += f", {scheduler.folded} folded"
+    if scheduler.skipped:
+        extra += f", {scheduler.skipped} up to date"
+    print(f"Rendered {rendered} poster(s), {failed} failed{extra}, "
+          f"{scheduler.bytes_written / (1024 * 1024):.1f} MB written, "
+          f"in {total:.2f}s with {scheduler.workers_wanted} worker(s)")
+    return rendered, failed
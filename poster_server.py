@@ -0,0 +1,323 @@
+# Local HTTP render service with warm worker processes.
+#
+#   POST /render   body: a job spec as JSON (same keys as a --batch line) -> encoded image
+#   GET  /stats    queue depth, request counts and latency percentiles as JSON
+#   GET  /health   "ok"
+#
+# Workers keep fonts, template bundles and base layers loaded between requests. Identical
+# specs that arrive while one is already rendering are coalesced onto the same render. If a
+# worker dies (e.g. killed for memory) the pool is replaced; the requests it was serving fail
+# with 503.
+#
+# The response is one image: specs asking for derivatives or strip rendering (which write
+# files) are rejected with 400, and derivatives a template bundle sets are not made.
+#
+# Specs name input files (background, logo, assets_dir, bundle, text_file, positions_file),
+# so anyone who can reach the server can have any image or text file it can read rendered
+# back to them. With --root those paths must lie inside that directory (relative ones are
+# taken from it); without it the service should only listen on a loopback address.
+# Animated jobs (GIF/WebP output with animated assets) are written by poster_animate to a
+# temporary file whose bytes are returned.
+import argparse
+import hashlib
+import ipaddress
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import poster_generator as gen
+from poster_cache import DEFAULT_MAX_BYTES
+from poster_output import encode_image, extension_for, format_for_path
+
+CONTENT_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'PNG': 'image/png', 'GIF': 'image/gif'}
+
+# Latencies kept for the percentile window
+LATENCY_WINDOW = 1000
+
+# Spec keys naming files or directories the render reads
+PATH_KEYS = ('background', 'logo', 'assets_dir', 'bundle', 'text_file', 'positions_file')
+
+
+def _init_render_worker(cache_bytes=DEFAULT_MAX_BYTES, warm_specs=()):
+    gen.BASE_LAYERS.max_bytes = cache_bytes
+    gen.load_fonts()
+    # Render the templates we expect once so their base layers are cached before the first request
+    for spec in warm_specs or ({},):
+        try:
+            gen.render_poster(spec)
+        except Exception:
+            pass
+
+
+def check_spec(spec, root=None):
+    """Raise ValueError for a spec the service cannot answer with one image, or whose input
+    paths leave root. With a root, the spec's paths are rewritten to absolute ones inside it."""
+    if not isinstance(spec, dict):
+        raise ValueError("spec must be a JSON object")
+    if spec.get('strip_height'):
+        raise ValueError("strip_height is not supported; strip renders are written by --batch")
+    if spec.get('derivatives') not in (None, 'none', [], ''):
+        raise ValueError("derivatives are not supported; the response is the poster alone")
+    if root is None:
+        return
+    root = os.path.realpath(root)
+    for key in PATH_KEYS:
+        if spec.get(key) is None:
+            continue
+        if not isinstance(spec[key], str):
+            raise ValueError(f"{key} must be a path")
+        path = os.path.realpath(os.path.join(root, spec[key]))
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError(f"{key} is outside the served root")
+        spec[key] = path
+
+
+def is_loopback(host):
+    """True if host only accepts connections from this machine."""
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def render_bytes(spec):
+    """Render spec in a worker and return (data, format, render_seconds, encode_seconds)."""
+    start = time.perf_counter()
+    job = gen.resolve_spec(spec)
+    # a template's default derivatives have nowhere to go
+    job['derivatives'] = []
+    if gen.is_animated_job(job):
+        return _render_animated_bytes(job, start)
+    final = gen.render_job(job)
+    rendered = time.perf_counter()
+    data = encode_image(final, job['format'], job['encoder'])
+    return data, job['format'], rendered - start, time.perf_counter() - rendered
+
+
+def _render_animated_bytes(job, start):
+    # the animation writers stream frames to a file, so render to a temporary one
+    fd, path = tempfile.mkstemp(suffix=extension_for(job['format']))
+    os.close(fd)
+    try:
+        res = gen.render_animated(dict(job, output=path))
+        with open(path, 'rb') as f:
+            data = f.read()
+    finally:
+        os.remove(path)
+    # frames are encoded as they are composited; the render time is the rest
+    encode_s = res.encode_seconds + res.write_seconds
+    return data, job['format'], time.perf_counter() - start - encode_s, encode_s
+
+
+def spec_key(spec):
+    """Key identifying identical requests; 'output' only matters through the format it implies."""
+    canonical = {k: v for k, v in spec.items() if k != 'output'}
+    canonical['format'] = (spec.get('format') or format_for_path(spec.get('output', gen.output_path))).upper()
+    return hashlib.sha1(json.dumps(canonical, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+class RenderService:
+    """Owns the worker pool, in-flight coalescing and request statistics."""
+
+    def __init__(self, workers=None, cache_bytes=DEFAULT_MAX_BYTES, warm_specs=()):
+        self.workers = workers
+        self.cache_bytes = cache_bytes
+        self.warm_specs = tuple(warm_specs)
+        self.pool = self._make_pool()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.renders = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.restarts = 0
+
+    def _make_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_init_render_worker,
+                                   initargs=(self.cache_bytes, self.warm_specs))
+
+    def _replace_pool(self, broken):
+        # called with the lock held; the broken pool's futures have already failed
+        if self.pool is broken:
+            self.pool = self._make_pool()
+            self.restarts += 1
+            broken.shutdown(wait=False)
+
+    def submit(self, spec):
+        """Return a future for spec's (data, format, ...) result, sharing it with identical in-flight requests."""
+        key = spec_key(spec)
+        with self._lock:
+            self.requests += 1
+            fut = self._inflight.get(key)
+            if fut is not None:
+                self.coalesced += 1
+                return fut
+            pool = self.pool
+            try:
+                fut = pool.submit(render_bytes, spec)
+            except BrokenProcessPool:
+                self._replace_pool(pool)
+                pool = self.pool
+                fut = pool.submit(render_bytes, spec)
+            self._inflight[key] = fut
+            self.renders += 1
+        fut.add_done_callback(lambda f, key=key, pool=pool: self._done(key, f, pool))
+        return fut
+
+    def _done(self, key, fut, pool):
+        broken = not fut.cancelled() and isinstance(fut.exception(), BrokenProcessPool)
+        with self._lock:
+            if self._inflight.get(key) is fut:
+                del self._inflight[key]
+            if broken:
+                self._replace_pool(pool)
+
+    def record(self, seconds, ok=True):
+        with self._lock:
+            self._latencies.append(seconds)
+            if not ok:
+                self.errors += 1
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            depth = len(self._inflight)
+            counts = {'requests': self.requests, 'renders': self.renders,
+                      'coalesced': self.coalesced, 'errors': self.errors, 'restarts': self.restarts}
+        ms = lambda v: None if v is None else round(v * 1000, 2)
+        return dict(counts, queue_depth=depth, latency_ms={
+            'p50': ms(percentile(latencies, 50)),
+            'p90': ms(percentile(latencies, 90)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(latencies[-1] if latencies else None),
+            'samples': len(latencies),
+        })
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+    server_version = 'PosterRender/1'
+
+    def _send(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, obj):
+        self._send(status, json.dumps(obj).encode('utf-8'))
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send_json(200, self.server.service.stats())
+        elif self.path == '/health':
+            self._send(200, b'ok', 'text/plain')
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/render':
+            self._send_json(404, {'error': 'not found'})
+            return
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            spec = json.loads(self.rfile.read(length) or b'{}')
+            check_spec(spec, self.server.root)
+        except ValueError as e:
+            self._send_json(400, {'error': f"bad request: {e}"})
+            return
+        service = self.server.service
+        try:
+            data, fmt, render_s, encode_s = service.submit(spec).result()
+        except BrokenProcessPool:
+            service.record(time.perf_counter() - start, ok=False)
+            self._send_json(503, {'error': "a render worker died; the pool was restarted, retry the request"})
+            return
+        except Exception as e:
+            service.record(time.perf_counter() - start, ok=False)
+            self._send_json(500, {'error': f"{type(e).__name__}: {e}"})
+            return
+        service.record(time.perf_counter() - start)
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPES.get(fmt, 'application/octet-stream'))
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('X-Render-Seconds', f"{render_s:.4f}")
+        self.send_header('X-Encode-Seconds', f"{encode_s:.4f}")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def make_server(host='127.0.0.1', port=8000, workers=None, cache_bytes=DEFAULT_MAX_BYTES,
+                warm_specs=(), quiet=False, root=None):
+    """Create (but do not start) the HTTP server. Use port=0 to pick a free port.
+
+    root, if given, is the directory every input path in a request must lie in."""
+    server = ThreadingHTTPServer((host, port), RenderHandler)
+    server.daemon_threads = True
+    server.service = RenderService(workers=workers, cache_bytes=cache_bytes, warm_specs=warm_specs)
+    server.quiet = quiet
+    server.root = root
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve poster renders over HTTP from warm worker processes")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="address to listen on; requests can read any file the server can unless "
+                             "--root is set, so keep the default loopback address otherwise")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--cache-mb', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="memory limit per worker for cached base layers, in MB")
+    parser.add_argument('--warm', action='append', default=[], metavar='BUNDLE',
+                        help="template bundle to preload in every worker (repeatable)")
+    parser.add_argument('--root', default=None, metavar='DIR',
+                        help="only read backgrounds, logos, assets, bundles, text and positions files "
+                             "inside DIR (relative paths in requests are taken from it)")
+    parser.add_argument('--quiet', action='store_true', help="do not log every request")
+    args = parser.parse_args(argv)
+    if not args.root and not is_loopback(args.host):
+        print(f"⚠️ Listening on {args.host} without --root: anyone who can reach it can have any image "
+              "or text file this process can read rendered back to them")
+
+    warm_specs = [{'bundle': b} for b in args.warm]
+    server = make_server(args.host, args.port, args.workers, args.cache_mb * 1024 * 1024,
+                         warm_specs, args.quiet, args.root)
+    host, port = server.server_address[:2]
+    print(f"Serving poster renders on http://{host}:{port} (POST /render, GET /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,163 @@
+# Strip rendering for print-size posters.
+#
+# The poster is composed one horizontal strip at a time: each strip is cut from the memory-mapped
+# background of a template bundle, receives only the logo, assets and text runs that intersect
+# it, is converted to RGB and streamed into a PNG. Peak memory is a few strips plus the logo and
+# asset thumbnails, whatever the canvas size; a full frame is never held.
+#
+# Jobs without a bundle get one compiled into STRIP_BUNDLE_DIR on first use. That compile
+# decodes the background once; every strip render after it reads the mapped pages only.
+# Bundles are keyed by content, so every background or logo edit compiles a new one; after
+# each compile the least recently used bundles beyond STRIP_BUNDLE_BYTES are deleted.
+import hashlib
+import os
+import struct
+import time
+import zlib
+
+from PIL import Image, ImageChops
+
+import poster_generator as gen
+from poster_bundle import compile_template, load_bundle
+from poster_cache import file_digest, trim_dir
+from poster_output import EncodeResult, StreamedFile, encoder_settings
+from poster_trace import stage
+
+STRIP_HEIGHT = 256
+STRIP_BUNDLE_DIR = os.path.join(gen.SCRIPT_DIR, '.poster_cache', 'bundles')
+# An A0 poster at 300 DPI compiles to a bundle of ~560 MB
+STRIP_BUNDLE_BYTES = 2 * 1024 * 1024 * 1024
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# PNG "Up" row filter: each byte minus the byte above it, which compresses far better than raw rows
+FILTER_UP = b'\x02'
+
+
+def strip_bundle_path(job):
+    """Path of the bundle compiled for a job without one (whether or not it exists yet)."""
+    key = hashlib.sha1('\0'.join((file_digest(job['background']), file_digest(job['logo']),
+                                  repr(tuple(job['logo_size'])))).encode('utf-8')).hexdigest()
+    return os.path.join(STRIP_BUNDLE_DIR, key + '.bundle')
+
+
+def strip_bundle(job):
+    """Return the template bundle job's strips are cut from, compiling and caching one if needed."""
+    if job.get('bundle'):
+        return load_bundle(job['bundle'])
+    path = strip_bundle_path(job)
+    if os.path.exists(path):
+        try:
+            # mark it recently used, so trimming deletes other bundles first
+            os.utime(path)
+        except OSError:
+            pass
+    else:
+        os.makedirs(STRIP_BUNDLE_DIR, exist_ok=True)
+        try:
+            with stage('strip_bundle'):
+                compile_template(job['positions_file'], path, background=job['background'], logo=job['logo'])
+        except OSError:
+            # another process compiling the same bundle may have finished first
+            if not os.path.exists(path):
+                raise
+        trim_dir(STRIP_BUNDLE_DIR, '.bundle', STRIP_BUNDLE_BYTES, keep=[path])
+    return load_bundle(path)
+
+
+def strip_elements(job, bundle):
+    """Return (pastes, runs): the logo and assets as [(image, (x, y))] in paste order, and the text runs."""
+    size = bundle.background.size
+    logo_box = tuple(job['logo_size'])
+    logo = bundle.logo if bundle.logo is not None and logo_box == bundle.logo_size else job['logo']
+    prepared, (dx, dy) = gen.LOGOS.get(logo, logo_box)[:2]
+    x, y = gen.logo_box_position(size, job['positions'], logo_box, gap=50)
+    pastes = [(prepared, (x + dx, y + dy))]
+    pastes += gen.asset_layout(size, gen.list_asset_files(job['assets_dir']))
+    runs = gen.layout_text_blocks(size, job['lines'], job['positions'], gen.load_fonts())
+    return pastes, runs
+
+
+def _overlaps(top, bottom, y0, y1):
+    return top < y1 and bottom > y0
+
+
+def render_strips(job, strip_height=STRIP_HEIGHT):
+    """Yield (y, strip) for a resolved job: RGB strips of strip_height rows, top to bottom."""
+    bundle = strip_bundle(job)
+    background = bundle.background
+    width, height = background.size
+    pastes, runs = strip_elements(job, bundle)
+    boxes = [gen.text_run_bbox(run) for run in runs]
+    for y0 in range(0, height, strip_height):
+        y1 = min(height, y0 + strip_height)
+        with stage('strip', y=y0):
+            # crop() copies just these rows out of the mapped background
+            strip = background.crop((0, y0, width, y1)).convert('RGB')
+            for im, (x, y) in pastes:
+                if _overlaps(y, y + im.height, y0, y1):
+                    strip.paste(im, (x, y - y0), im)
+            for run, box in zip(runs, boxes):
+                if _overlaps(box[1], box[3], y0, y1):
+                    gen.draw_text_run(strip, run, origin=(0, y0))
+        # rows above this strip are never read again
+        bundle.release_rows('background', 0, y1)
+        yield y0, strip
+
+
+def _chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+
+def write_png_strips(path, size, strips, compress_level=6):
+    """Stream RGB strips (top to bottom, full width) into a PNG at path. Returns (bytes, encode_s, write_s)."""
+    width, height = size
+    stride = width * 3
+    compressor = zlib.compressobj(compress_level)
+    above = Image.new('RGB', (width, 1))
+    encode_seconds = 0.0
+    with StreamedFile(path) as out:
+        write = out.write
+        write(PNG_SIGNATURE + _chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        for _, strip in strips:
+            start = time.perf_counter()
+            with stage('encode_strip'):
+                # the row above each row: the previous strip's last row, then this strip shifted down
+                prior = Image.new('RGB', strip.size)
+                prior.paste(above, (0, 0))
+                prior.paste(strip.crop((0, 0, width, strip.height - 1)), (0, 1))
+                above = strip.crop((0, strip.height - 1, width, strip.height))
+                raw = ImageChops.subtract_modulo(strip, prior).tobytes()
+                data = compressor.compress(b''.join(FILTER_UP + raw[i:i + stride]
+                                                    for i in range(0, len(raw), stride)))
+            encode_seconds += time.perf_counter() - start
+            if data:
+                write(_chunk(b'IDAT', data))
+        write(_chunk(b'IDAT', compressor.flush()) + _chunk(b'IEND', b''))
+    return out.bytes, encode_seconds, out.write_seconds
+
+
+def _observe(strips, on_strip):
+    for y, strip in strips:
+        on_strip(y, strip)
+        yield y, strip
+
+
+def render_striped(job, strip_height=None, on_strip=None):
+    """Render a resolved job strip by strip straight into its PNG output. Returns an EncodeResult.
+
+    on_strip(y, strip) is called with each strip before it is encoded."""
+    if job['format'] != 'PNG':
+        raise ValueError(f"strip rendering writes PNG, not {job['format']}")
+    if job['derivatives']:
+        raise ValueError("derivatives need the full frame and cannot be combined with strip rendering")
+    strip_height = int(strip_height or job.get('strip_height') or STRIP_HEIGHT)
+    out_dir = os.path.dirname(job['output'])
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    size = strip_bundle(job).background.size
+    level = encoder_settings('PNG', job['encoder'])['compress_level']
+    strips = render_strips(job, strip_height)
+    if on_strip:
+        strips = _observe(strips, on_strip)
+    written, encode_s, write_s = write_png_strips(job['output'], size, strips, level)
+    return EncodeResult(job['output'], 'PNG', written, encode_s, write_s)
@@ -0,0 +1,257 @@
+# Optional per-stage instrumentation for the render pipeline.
+#
+#   with stage('decode'):
+#       ...
+#
+# Disabled (the default) stage() hands back a shared no-op context manager, so the hooks cost a
+# function call. Enabled, every stage records wall time, CPU time of the calling thread, the peak
+# of Python-heap allocations traced by tracemalloc and how far the process's RSS peaked above
+# its level at the start of the stage. Events can be written as a Chrome trace
+# (chrome://tracing, Perfetto) and summarised per stage.
+#
+# tracemalloc only sees the Python heap: Pillow's pixel buffers are allocated outside it and
+# show up in the RSS peak instead. Its peak is one counter for the whole process, so a stage
+# resets it only while no other thread is inside a stage; a stage that overlaps another
+# thread's reports the peak of both, and so does the RSS peak.
+#
+# The RSS peak of a stage is the highest of its current RSS at start and end (from
+# /proc/self/statm), the readings a sampling thread takes every RSS_SAMPLE_INTERVAL while any
+# stage is open, and the process's lifetime peak (ru_maxrss) if that grew during the stage,
+# which catches spikes shorter than the interval that set a new high. Without /proc it is how
+# much the lifetime peak grew during the stage.
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_NULL = contextlib.nullcontext()
+
+# Seconds between RSS samples while a stage is open
+RSS_SAMPLE_INTERVAL = 0.002
+
+
+_PAGE_KB = os.sysconf('SC_PAGE_SIZE') // 1024 if hasattr(os, 'sysconf') else 4
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process in KB, or None where it is not available."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KB elsewhere
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def current_rss_kb():
+    """Current resident set size of this process in KB, or None where it is not available."""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * _PAGE_KB
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'args', 'start', 'cpu', 'mem', 'peak', 'rss', 'rss_peak', 'maxrss')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.peak = 0
+        self.rss = self.rss_peak = current_rss_kb()
+        self.maxrss = peak_rss_kb()
+        self.tracer._push(self)
+        if self.tracer.memory:
+            self.mem = tracemalloc.get_traced_memory()[0]
+            self.tracer._reset_peak()
+        self.cpu = time.thread_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        cpu = time.thread_time() - self.cpu
+        if self.tracer.memory:
+            # nested stages reset the peak, so fold in the peaks they saw
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            alloc = self.peak - self.mem
+        else:
+            alloc = None
+        self.tracer._pop(self)
+        self.tracer._record(self, end, cpu, alloc, self._rss_peak())
+        return False
+
+    def _rss_peak(self):
+        # KB the RSS rose above its level at the start of the stage, at its highest
+        rss, maxrss = current_rss_kb(), peak_rss_kb()
+        grew = maxrss is not None and self.maxrss is not None and maxrss > self.maxrss
+        if rss is None or self.rss is None:
+            return maxrss - self.maxrss if maxrss is not None and self.maxrss is not None else None
+        peak = max(self.rss_peak, rss, maxrss if grew else 0)
+        return peak - self.rss
+
+
+class Tracer:
+    """Collects stage events. One per process; worker processes send theirs back with drain()."""
+
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.events = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # threads currently inside at least one stage, and every open stage (for RSS sampling)
+        self._active = 0
+        self._open = set()
+        self._sampler = None
+        self._stop_sampling = threading.Event()
+        self._epoch = time.perf_counter()
+        # wall clock at _epoch, so events from several processes line up in one trace
+        self._epoch_us = time.time() * 1e6
+
+    def enable(self, memory=True):
+        self.enabled = True
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        # a tracer inherited through fork has no sampling thread
+        if current_rss_kb() is not None and (self._sampler is None or not self._sampler.is_alive()):
+            self._stop_sampling.clear()
+            self._sampler = threading.Thread(target=self._sample_rss, name='rss-sampler', daemon=True)
+            self._sampler.start()
+
+    def disable(self):
+        self.enabled = False
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.memory = False
+        if self._sampler is not None:
+            self._stop_sampling.set()
+            self._sampler.join()
+            self._sampler = None
+
+    def _sample_rss(self):
+        while not self._stop_sampling.wait(RSS_SAMPLE_INTERVAL):
+            if not self._open:
+                continue
+            rss = current_rss_kb()
+            if rss is None:
+                return
+            with self._lock:
+                for span in self._open:
+                    if rss > span.rss_peak:
+                        span.rss_peak = rss
+
+    def stage(self, name, **args):
+        if not self.enabled:
+            return _NULL
+        return _Span(self, name, args)
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _push(self, span):
+        stack = self._stack()
+        with self._lock:
+            if not stack:
+                self._active += 1
+            if span.rss is not None:
+                self._open.add(span)
+        stack.append(span)
+
+    def _reset_peak(self):
+        # the peak is process-wide: resetting it under another thread's open stage would lose
+        # what that stage has allocated so far
+        with self._lock:
+            if self._active <= 1:
+                tracemalloc.reset_peak()
+
+    def _pop(self, span):
+        stack = self._stack()
+        stack.pop()
+        with self._lock:
+            if not stack:
+                self._active -= 1
+            self._open.discard(span)
+        if stack and self.memory:
+            stack[-1].peak = max(stack[-1].peak, span.peak)
+
+    def _record(self, span, end, cpu, alloc, rss_peak):
+        event = {
+            'name': span.name,
+            'ph': 'X',
+            'ts': round(self._epoch_us + (span.start - self._epoch) * 1e6, 1),
+            'dur': round((end - span.start) * 1e6, 1),
+            'pid': os.getpid(),
+            'tid': threading.get_native_id(),
+            'args': dict(span.args, cpu_ms=round(cpu * 1000, 3)),
+        }
+        if alloc is not None:
+            event['args']['py_heap_peak_kb'] = round(alloc / 1024, 1)
+        if rss_peak is not None:
+            event['args']['rss_peak_kb'] = rss_peak
+        with self._lock:
+            self.events.append(event)
+
+    def drain(self):
+        """Return and forget the events recorded so far."""
+        with self._lock:
+            events, self.events = self.events, []
+        return events
+
+    def extend(self, events):
+        """Add events recorded elsewhere (e.g. in a worker process)."""
+        with self._lock:
+            self.events.extend(events)
+
+
+def summarize(events):
+    """Aggregate events per stage name, in order of total wall time."""
+    stats = {}
+    for ev in events:
+        s = stats.setdefault(ev['name'], {'count': 0, 'wall_ms': 0.0, 'cpu_ms': 0.0,
+                                          'py_heap_peak_kb': None, 'rss_peak_kb': None})
+        args = ev.get('args', {})
+        s['count'] += 1
+        s['wall_ms'] += ev['dur'] / 1000
+        s['cpu_ms'] += args.get('cpu_ms', 0.0)
+        # the largest of each stage's readings
+        for key in ('py_heap_peak_kb', 'rss_peak_kb'):
+            if args.get(key) is not None:
+                s[key] = args[key] if s[key] is None else max(s[key], args[key])
+    return dict(sorted(stats.items(), key=lambda item: -item[1]['wall_ms']))
+
+
+def format_summary(events):
+    """Return the per-stage summary as a printable table."""
+    rows = [f"{'stage':<20}{'count':>7}{'wall ms':>12}{'mean ms':>10}{'cpu ms':>12}{'py heap KB':>12}{'rss peak +KB':>14}"]
+    for name, s in summarize(events).items():
+        fmt = lambda v: '-' if v is None else f"{v:.0f}"
+        rows.append(f"{name:<20}{s['count']:>7}{s['wall_ms']:>12.1f}{s['wall_ms'] / s['count']:>10.2f}"
+                    f"{s['cpu_ms']:>12.1f}{fmt(s['py_heap_peak_kb']):>12}{fmt(s['rss_peak_kb']):>14}")
+    return '\n'.join(rows)
+
+
+def write_chrome_trace(path, events):
+    """Write events in the Chrome trace event format."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+# Shared per-process tracer; poster modules wrap their stages with stage()
+TRACER = Tracer()
+stage = TRACER.stage